@@ -1,10 +1,238 @@
 import json
+import re
 import pandas as pd
 import requests
 import plotly.express as px
 import os
 
+# 预编译SQL校验用正则，每次生成/校验复用，避免逐次编译开销
+_FROM_TABLE_RE = re.compile(r'FROM\s+([\w\[\]\.]+)', re.IGNORECASE)
+_JOIN_TABLE_RE = re.compile(r'JOIN\s+([\w\[\]\.]+)', re.IGNORECASE)
+_FROM_ALIAS_RE = re.compile(r'FROM\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)', re.IGNORECASE)
+_JOIN_ALIAS_RE = re.compile(r'JOIN\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)', re.IGNORECASE)
+_ALIASED_FIELD_RE = re.compile(r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]')
+_BRACKET_FIELD_RE = re.compile(r'\[([^\]]+)\]')
+_WHERE_CLAUSE_RE = re.compile(r'WHERE\s+(.*?)(?=\s*ORDER\s+BY|\s*GROUP\s+BY|\s*HAVING|\s*$)', re.IGNORECASE | re.DOTALL)
+_JOIN_ON_RE = re.compile(r'JOIN\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)\s+ON\s+([^\n]+)', re.IGNORECASE)
+_ON_PAIR_RE = re.compile(r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]\s*=\s*([a-zA-Z0-9_]+)\.\[([^\]]+)\]')
+_REL_DESC_RE = re.compile(r'([\w]+)\.([\w\s]+)\s*(=|<->|==|等于)\s*([\w]+)\.([\w\s]+)')
+_TIME_CONDITION_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r'\[自然年\]', r'\[财月\]', r'\[财周\]', r'\[财年\]', r'\[年\]', r'\[月\]', r'\[日\]',
+    r'YEAR\s*\(', r'MONTH\s*\(', r'GETDATE\s*\(\s*\)\s*\)', r'CAST\s*\(.*?AS.*?VARCHAR\s*\)'
+)]
+
+import functools
+
+@functools.lru_cache(maxsize=128)
+def _classify_result_columns(columns, dtype_strs):
+    """按列名和dtype划分结果列（纯函数，按列结构缓存，rerun时O(1)返回）"""
+    categorical_cols = []
+    numeric_cols = []
+    doi_cols = []
+    for col, dtype_str in zip(columns, dtype_strs):
+        if dtype_str == 'object' or col in ['Roadmap Family', 'MTM', '产品', '型号']:
+            categorical_cols.append(col)
+        else:
+            if 'DOI' in col or '周转天' in col:
+                doi_cols.append(col)
+            else:
+                numeric_cols.append(col)
+    return categorical_cols, numeric_cols, doi_cols
+
+# 进程级共享HTTP会话：所有DeepSeek调用复用TCP/TLS连接，省掉每次握手
+DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+
+def _build_deepseek_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_DEEPSEEK_SESSION = _build_deepseek_session()
+
+# 模块级版本号：知识库/数据库配置保存时+1，UI据此判断派生缓存是否过期
+# （引擎实例每次rerun可能重建，计数器必须放在模块级才能跨rerun存活）
+_KB_VERSION = 0
+_DB_VERSION = 0
+_PK_VERSION = 0
+
+def kb_version():
+    return _KB_VERSION
+
+def db_version():
+    return _DB_VERSION
+
+def pk_version():
+    return _PK_VERSION
+
+def _bump_kb_version():
+    global _KB_VERSION
+    _KB_VERSION += 1
+
+def _bump_db_version():
+    global _DB_VERSION
+    _DB_VERSION += 1
+
+def _bump_pk_version():
+    global _PK_VERSION
+    _PK_VERSION += 1
+
+# 历史问答对追加式日志，点赞时O(1)追加而不是全量重写
+HISTORICAL_QA_LOG = "historical_qa.jsonl"
+
+def load_historical_qa():
+    """加载历史问答对：优先读取追加式JSONL日志，兼容旧的historical_qa.json"""
+    if os.path.exists(HISTORICAL_QA_LOG):
+        try:
+            qa_list = []
+            with open(HISTORICAL_QA_LOG, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        qa_list.append(json.loads(line))
+            return qa_list
+        except Exception as e:
+            print(f"加载历史问答日志失败: {e}")
+    try:
+        if os.path.exists("historical_qa.json"):
+            with open("historical_qa.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"加载历史问答对失败: {e}")
+    return []
+
+def save_historical_qa(qa_list):
+    """全量重写历史问答日志（删除/清空记录时使用）"""
+    try:
+        with open(HISTORICAL_QA_LOG, 'w', encoding='utf-8') as f:
+            for qa in qa_list:
+                f.write(json.dumps(qa, ensure_ascii=False) + "\n")
+        return True
+    except Exception as e:
+        print(f"保存历史问答对失败: {e}")
+        return False
+
+def append_historical_qa(qa_record):
+    """追加单条历史问答到日志末尾"""
+    try:
+        with open(HISTORICAL_QA_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(qa_record, ensure_ascii=False) + "\n")
+        return True
+    except Exception as e:
+        print(f"追加历史问答对失败: {e}")
+        return False
+
+# orjson为可选加速依赖：编码约4x于纯Python json，缺失时自动退回
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+def atomic_write_json(path, obj):
+    """序列化并原子落盘：优先orjson，临时文件+os.replace保证不写坏原文件"""
+    tmp_path = path + ".tmp"
+    if _orjson is not None:
+        with open(tmp_path, "wb") as f:
+            f.write(_orjson.dumps(obj, option=_orjson.OPT_INDENT_2 | _orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# 业务规则元数据追加式日志：每条变更O(1)追加，取代全量重写
+BUSINESS_RULES_META_LOG = "business_rules_meta.jsonl"
+
+class _AsyncJsonlWriter:
+    """后台追加写JSONL：put立即返回，守护线程串行落盘，不阻塞UI回调"""
+    def __init__(self, path):
+        import threading
+        import queue
+        self.path = path
+        self.q = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"追加写入{self.path}失败: {e}")
+
+    def put(self, item):
+        self.q.put(item)
+
+_META_WRITER = None
+
+def append_business_rules_meta(term, meta):
+    """异步追加一条术语元数据变更（meta=None表示删除该术语）"""
+    global _META_WRITER
+    if _META_WRITER is None:
+        _META_WRITER = _AsyncJsonlWriter(BUSINESS_RULES_META_LOG)
+    _META_WRITER.put({"term": term, "meta": meta})
+
+def load_business_rules_meta():
+    """加载术语元数据：旧版全量JSON作底，再按序回放JSONL增量"""
+    meta = {}
+    try:
+        if os.path.exists("business_rules_meta.json"):
+            with open("business_rules_meta.json", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+    except Exception as e:
+        print(f"加载业务规则元数据失败: {e}")
+    try:
+        if os.path.exists(BUSINESS_RULES_META_LOG):
+            with open(BUSINESS_RULES_META_LOG, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("meta") is None:
+                        meta.pop(entry.get("term"), None)
+                    else:
+                        meta[entry["term"]] = entry["meta"]
+    except Exception as e:
+        print(f"回放业务规则元数据日志失败: {e}")
+    return meta
+
 # ====== MOCK/占位实现 ======
+@functools.lru_cache(maxsize=16)
+def _get_pooled_engine(conn_str):
+    """按连接串缓存的SQLAlchemy引擎：连接池复用TCP+TLS+认证握手"""
+    from sqlalchemy import create_engine
+    return create_engine(
+        conn_str,
+        pool_size=10,
+        max_overflow=15,
+        pool_pre_ping=True,
+        pool_recycle=1800
+    )
+
+@functools.lru_cache(maxsize=16)
+def _get_sqlite_engine(file_path):
+    """按文件路径缓存的SQLite引擎：连接时设置WAL等PRAGMA，连接可跨线程复用"""
+    from sqlalchemy import create_engine, event
+    engine = create_engine(
+        f"sqlite:///{file_path}",
+        connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+    return engine
+
 class DatabaseManager:
     def get_mssql_connection_string(self, config):
         base = f"mssql+pyodbc://{config['username']}:{config['password']}@{config['server']}/{config['database']}?driver={config['driver'].replace(' ', '+')}"
@@ -13,19 +241,32 @@ class DatabaseManager:
             base += "&" + "&".join(extras)
         return base
 
+    def get_mssql_engine(self, config):
+        """获取带连接池的MSSQL引擎（同配置全局复用）"""
+        return _get_pooled_engine(self.get_mssql_connection_string(config))
+
+    def get_sqlite_engine(self, config):
+        """获取带PRAGMA预设的SQLite引擎（同文件全局复用）"""
+        return _get_sqlite_engine(config["file_path"])
+
     def test_connection(self, db_type, config):
         try:
             if db_type == "sqlite":
-                import sqlite3
-                conn = sqlite3.connect(config["file_path"])
-                conn.close()
+                from sqlalchemy import text
+                engine = self.get_sqlite_engine(config)
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
                 return True, "SQLite连接成功"
             elif db_type == "mssql":
                 from sqlalchemy import create_engine, text
+                # 连接测试用一次性引擎，避免错误凭据污染共享连接池
                 conn_str = self.get_mssql_connection_string(config)
                 engine = create_engine(conn_str)
-                with engine.connect() as conn:
-                    conn.execute(text("SELECT 1"))
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(text("SELECT 1"))
+                finally:
+                    engine.dispose()
                 return True, "MSSQL连接成功"
             else:
                 return False, "不支持的数据库类型"
@@ -35,17 +276,15 @@ class DatabaseManager:
     def get_tables(self, db_type, config):
         try:
             if db_type == "sqlite":
-                import sqlite3
-                conn = sqlite3.connect(config["file_path"])
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = [row[0] for row in cursor.fetchall()]
-                conn.close()
+                from sqlalchemy import text
+                engine = self.get_sqlite_engine(config)
+                with engine.connect() as conn:
+                    result = conn.execute(text("SELECT name FROM sqlite_master WHERE type='table';"))
+                    tables = [row[0] for row in result.fetchall()]
                 return tables
             elif db_type == "mssql":
-                from sqlalchemy import create_engine, text
-                conn_str = self.get_mssql_connection_string(config)
-                engine = create_engine(conn_str)
+                from sqlalchemy import text
+                engine = self.get_mssql_engine(config)
                 with engine.connect() as conn:
                     result = conn.execute(text("SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE='BASE TABLE'"))
                     tables = [row[0] for row in result.fetchall()]
@@ -59,17 +298,15 @@ class DatabaseManager:
     def get_table_schema(self, db_type, config, table_name):
         try:
             if db_type == "sqlite":
-                import sqlite3
-                conn = sqlite3.connect(config["file_path"])
-                cursor = conn.cursor()
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = [row[1] for row in cursor.fetchall()]
-                conn.close()
+                from sqlalchemy import text
+                engine = self.get_sqlite_engine(config)
+                with engine.connect() as conn:
+                    result = conn.execute(text(f"PRAGMA table_info({table_name})"))
+                    columns = [row[1] for row in result.fetchall()]
                 return {"columns": columns, "column_info": []}
             elif db_type == "mssql":
-                from sqlalchemy import create_engine, text
-                conn_str = self.get_mssql_connection_string(config)
-                engine = create_engine(conn_str)
+                from sqlalchemy import text
+                engine = self.get_mssql_engine(config)
                 with engine.connect() as conn:
                     result = conn.execute(text(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME='{table_name}'"))
                     columns = [row[0] for row in result.fetchall()]
@@ -80,6 +317,35 @@ class DatabaseManager:
             print(f"获取表结构失败: {e}")
             return {"columns": [], "column_info": []}
 
+    def get_all_schemas(self, db_type, config, table_names):
+        """一次查询批量获取多张表的字段信息，返回 表名 -> schema 的字典"""
+        schemas = {}
+        if not table_names:
+            return schemas
+        try:
+            if db_type == "mssql":
+                from sqlalchemy import text
+                wanted = set(table_names)
+                engine = self.get_mssql_engine(config)
+                with engine.connect() as conn:
+                    result = conn.execute(text(
+                        "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                        "ORDER BY TABLE_NAME, ORDINAL_POSITION"
+                    ))
+                    for table_name, column_name in result.fetchall():
+                        if table_name in wanted:
+                            schemas.setdefault(table_name, {"columns": [], "column_info": []})
+                            schemas[table_name]["columns"].append(column_name)
+                return schemas
+            else:
+                # sqlite等类型没有统一的批量元数据查询，退回逐表获取
+                for table in table_names:
+                    schemas[table] = self.get_table_schema(db_type, config, table)
+                return schemas
+        except Exception as e:
+            print(f"批量获取表结构失败: {e}")
+            return schemas
+
 class VannaWrapper:
     def __init__(self, api_key=None):
         self.api_key = "sk-0e6005b793aa4759bb022b91e9055f86"
@@ -99,6 +365,17 @@ class VannaWrapper:
         if training_item:
             self.training_data.append(training_item)
             print(f"训练数据已添加: {training_item}")
+
+    def train_qa_batch(self, qa_pairs):
+        """批量训练问答对，一次提交避免逐条调用的开销"""
+        items = [
+            {'question': qa['question'], 'sql': qa['sql']}
+            for qa in qa_pairs
+            if qa.get('question') and qa.get('sql')
+        ]
+        if items:
+            self.training_data.extend(items)
+            print(f"批量训练问答对: {len(items)} 条")
     
     def generate_sql(self, prompt):
         headers = {
@@ -111,8 +388,8 @@ class VannaWrapper:
             "temperature": 0.1,
             "max_tokens": 1000
         }
-        response = requests.post(
-            "https://api.deepseek.com/v1/chat/completions",
+        response = _DEEPSEEK_SESSION.post(
+            DEEPSEEK_API_URL,
             headers=headers,
             json=data,
             timeout=30
@@ -161,10 +438,60 @@ class Text2SQLQueryEngine:
         self.db_manager = db_manager
         self.prompt_templates = prompt_templates
         self.databases = {}
-        
+
         # 验证表存在性
         self._validate_table_existence()
-    
+
+        # 预建小写表名索引，问题匹配目标表时一次构建多次复用
+        self._table_name_index = None
+
+        # 提示词中与问题无关的schema部分（表结构/关系/规则/示例）缓存
+        self._schema_context = None
+
+        # 规范化后的 表名 -> 字段集合 索引，字段校验按集合O(1)查找
+        self._column_sets = None
+
+    def _build_table_name_index(self):
+        """构建 小写表名 -> 原始表名 的索引（长表名优先，避免短名抢先匹配）"""
+        names = sorted(self.table_knowledge.keys(), key=len, reverse=True)
+        return [(name.lower(), name) for name in names]
+
+    def invalidate_table_name_index(self):
+        """表知识库变更后失效表名索引"""
+        self._table_name_index = None
+        self._schema_context = None
+        self._column_sets = None
+
+    def _get_column_sets(self):
+        """获取 规范化表名 -> 原表名及规范化字段集合 的索引（缓存，字段校验复用）"""
+        if self._column_sets is None:
+            column_sets = {}
+            for table_name, table_info in self.table_knowledge.items():
+                fields = set()
+                for col in table_info.get('columns', []):
+                    if isinstance(col, dict) and 'name' in col:
+                        fields.add(col['name'].replace('[', '').replace(']', '').strip().lower())
+                    elif isinstance(col, str):
+                        fields.add(col.replace('[', '').replace(']', '').strip().lower())
+                norm_name = table_name.split('.')[-1].replace('[', '').replace(']', '').strip().lower()
+                column_sets[norm_name] = (table_name, frozenset(fields))
+            self._column_sets = column_sets
+        return self._column_sets
+
+    def invalidate_schema_context(self):
+        """知识库/规则/关系变更后失效提示词schema缓存"""
+        self._schema_context = None
+
+    def detect_target_table(self, question):
+        """从问题中识别目标表：单次小写化后在预建索引上线性匹配"""
+        if self._table_name_index is None:
+            self._table_name_index = self._build_table_name_index()
+        question_lower = question.lower()
+        for name_lower, name in self._table_name_index:
+            if name_lower in question_lower:
+                return name
+        return None
+
     def _validate_table_existence(self):
         """验证表知识库中的表是否存在"""
         if not self.db_manager:
@@ -224,12 +551,11 @@ class Text2SQLQueryEngine:
                 tables_without_time.append(table_name)
         return tables_without_time
     
-    def generate_prompt(self, question, target_table=None):
-        processed_question = self.apply_business_rules(question, target_table)
-        
-        # 智能聚类分析
-        clustering_analysis = self._analyze_clustering_requirements(question)
-        
+    def _build_schema_context(self):
+        """构建提示词中与问题无关的schema部分，结果缓存到知识库变更为止"""
+        if self._schema_context is not None:
+            return self._schema_context
+
         # 检查表的时间字段情况
         tables_without_time = self.get_tables_without_time_fields()
         time_field_warning = ""
@@ -241,7 +567,7 @@ class Text2SQLQueryEngine:
 
 注意：如果查询涉及这些表，请勿添加时间相关的WHERE条件。
 """
-        
+
         # 构建包含数据库名称的表结构信息
         existing_tables = {
             "dtsupply_summary": "FF_IDSS_Dev_FF.dbo.dtsupply_summary",
@@ -251,7 +577,7 @@ class Text2SQLQueryEngine:
             "con_target": "FF_IDSS_Data_CON_BAK.dbo.con_target",
             "ConDT_Commit": "FF_IDSS_Data_CON_BAK.dbo.ConDT_Commit",
         }
-        
+
         table_lines = []
         for tbl, info in self.table_knowledge.items():
             if tbl in existing_tables:
@@ -267,7 +593,7 @@ class Text2SQLQueryEngine:
                     table_lines.append(f"- {full_table_name}: {', '.join(column_names)}")
                 else:
                     table_lines.append(f"- {full_table_name}: {columns}")
-        
+
         table_struct = '\n'.join(table_lines)
         rel_lines = []
         for rel in self.relationships.get('relationships', []):
@@ -283,10 +609,31 @@ class Text2SQLQueryEngine:
         if self.historical_qa:
             for qa in self.historical_qa[:3]:
                 qa_examples += f"\n【历史问答】问题：{qa['question']}，SQL：{qa['sql']}"
-        
+
+        self._schema_context = {
+            'time_field_warning': time_field_warning,
+            'table_struct': table_struct,
+            'rel_struct': rel_struct,
+            'rules_str': rules_str,
+            'qa_examples': qa_examples,
+        }
+        return self._schema_context
+
+    def generate_prompt(self, question, target_table=None):
+        processed_question = self.apply_business_rules(question, target_table)
+
+        # 智能聚类分析
+        clustering_analysis = self._analyze_clustering_requirements(question)
+
+        # schema部分与问题无关，直接取缓存
+        schema_ctx = self._build_schema_context()
+        time_field_warning = schema_ctx['time_field_warning']
+        table_struct = schema_ctx['table_struct']
+        rel_struct = schema_ctx['rel_struct']
+        rules_str = schema_ctx['rules_str']
+        qa_examples = schema_ctx['qa_examples']
+
         # 提取定语信息用于SELECT第一列
-        import re
-        
         # 查找业务术语作为定语
         qualifier_terms = []
         for term, rule_info in self.business_rules.items():
@@ -533,14 +880,8 @@ class Text2SQLQueryEngine:
         """应用业务规则转换，支持表限制和复杂条件"""
         import re
         
-        # 加载业务规则元数据
-        business_rules_meta = {}
-        try:
-            if os.path.exists("business_rules_meta.json"):
-                with open("business_rules_meta.json", 'r', encoding='utf-8') as f:
-                    business_rules_meta = json.load(f)
-        except:
-            pass
+        # 加载业务规则元数据（全量JSON + JSONL增量日志）
+        business_rules_meta = load_business_rules_meta()
         
         processed_question = question
         
@@ -820,15 +1161,11 @@ class Text2SQLQueryEngine:
     
     def extract_tables_from_sql(self, sql):
         """从SQL中提取表名"""
-        import re
         tables = []
-        
+
         # 提取FROM和JOIN中的表名
-        from_pattern = r'FROM\s+([\w\[\]\.]+)'
-        join_pattern = r'JOIN\s+([\w\[\]\.]+)'
-        
-        for pattern in [from_pattern, join_pattern]:
-            for match in re.findall(pattern, sql, re.IGNORECASE):
+        for pattern in [_FROM_TABLE_RE, _JOIN_TABLE_RE]:
+            for match in pattern.findall(sql):
                 # 提取表名（去掉数据库名和schema）
                 table_name = match.split('.')[-1].replace('[', '').replace(']', '')
                 tables.append(table_name)
@@ -837,18 +1174,11 @@ class Text2SQLQueryEngine:
     
     def validate_time_conditions(self, sql, tables_in_sql):
         """验证SQL中的时间条件是否与表结构匹配"""
-        import re
-        
-        # 检查SQL中的时间条件
+        # 检查SQL中的时间条件（预编译模式）
         time_conditions = []
-        time_patterns = [
-            r'\[自然年\]', r'\[财月\]', r'\[财周\]', r'\[财年\]', r'\[年\]', r'\[月\]', r'\[日\]',
-            r'YEAR\s*\(', r'MONTH\s*\(', r'GETDATE\s*\(\s*\)\s*\)', r'CAST\s*\(.*?AS.*?VARCHAR\s*\)'
-        ]
-        
-        for pattern in time_patterns:
-            if re.search(pattern, sql, re.IGNORECASE):
-                time_conditions.append(pattern)
+        for pattern in _TIME_CONDITION_RES:
+            if pattern.search(sql):
+                time_conditions.append(pattern.pattern)
         
         if not time_conditions:
             return "SQL中未发现时间条件，无需检查。"
@@ -871,8 +1201,6 @@ class Text2SQLQueryEngine:
     
     def enhanced_local_field_check(self, sql):
         """增强版本地字段校验，支持表别名和关系校验"""
-        import re
-        
         def norm_table_name(name):
             if '.' in name:
                 name = name.split('.')[-1]
@@ -883,76 +1211,53 @@ class Text2SQLQueryEngine:
         
         # 1. 解析表别名映射
         alias2table = {}
-        from_pattern = r'FROM\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)'
-        join_pattern = r'JOIN\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)'
-        for pat in [from_pattern, join_pattern]:
-            for m in re.findall(pat, sql, re.IGNORECASE):
+        for pat in [_FROM_ALIAS_RE, _JOIN_ALIAS_RE]:
+            for m in pat.findall(sql):
                 table, alias = m
                 alias2table[alias] = norm_table_name(table)
-        
-        # 2. 字段校验 - 检查所有字段引用
+
+        # 2. 字段校验 - 检查所有字段引用（预建字段集合索引，O(1)查找）
         field_results = []
-        
+        column_sets = self._get_column_sets()
+
         # 检查SELECT子句中的字段
-        select_pattern = r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]'
-        for alias, field in re.findall(select_pattern, sql):
+        aliased_field_matches = _ALIASED_FIELD_RE.findall(sql)
+        for alias, field in aliased_field_matches:
             table = alias2table.get(alias)
             if not table:
                 field_results.append(f"别名[{alias}]未找到对应表")
                 continue
-                
-            matched_table = None
-            for tk in self.table_knowledge:
-                if norm_table_name(tk) == table:
-                    matched_table = tk
-                    break
-            if not matched_table:
+
+            entry = column_sets.get(table)
+            if not entry:
                 field_results.append(f"表[{table}]未在知识库中定义")
                 continue
-                
-            # 处理columns字段
-            columns = []
-            for col in self.table_knowledge[matched_table]['columns']:
-                if isinstance(col, dict) and 'name' in col:
-                    columns.append(norm_field_name(col['name']))
-                elif isinstance(col, str):
-                    columns.append(norm_field_name(col))
-                    
+            matched_table, columns = entry
+
             if norm_field_name(field) in columns:
                 field_results.append(f"表[{matched_table}] 字段[{field}] (别名:{alias}) : 存在")
             else:
                 field_results.append(f"表[{matched_table}] 字段[{field}] (别名:{alias}) : 不存在")
         
         # 检查WHERE子句中的字段
-        where_pattern = r'WHERE\s+(.*?)(?=\s*ORDER\s+BY|\s*GROUP\s+BY|\s*HAVING|\s*$)'
-        where_match = re.search(where_pattern, sql, re.IGNORECASE | re.DOTALL)
+        where_match = _WHERE_CLAUSE_RE.search(sql)
+        where_field_matches = []
         if where_match:
             where_clause = where_match.group(1)
             # 提取WHERE中的字段引用
-            where_field_pattern = r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]'
-            for alias, field in re.findall(where_field_pattern, where_clause):
+            where_field_matches = _ALIASED_FIELD_RE.findall(where_clause)
+            for alias, field in where_field_matches:
                 table = alias2table.get(alias)
                 if not table:
                     field_results.append(f"WHERE中别名[{alias}]未找到对应表")
                     continue
-                    
-                matched_table = None
-                for tk in self.table_knowledge:
-                    if norm_table_name(tk) == table:
-                        matched_table = tk
-                        break
-                if not matched_table:
+
+                entry = column_sets.get(table)
+                if not entry:
                     field_results.append(f"WHERE中表[{table}]未在知识库中定义")
                     continue
-                    
-                # 处理columns字段
-                columns = []
-                for col in self.table_knowledge[matched_table]['columns']:
-                    if isinstance(col, dict) and 'name' in col:
-                        columns.append(norm_field_name(col['name']))
-                    elif isinstance(col, str):
-                        columns.append(norm_field_name(col))
-                        
+                matched_table, columns = entry
+
                 if norm_field_name(field) in columns:
                     field_results.append(f"WHERE中表[{matched_table}] 字段[{field}] (别名:{alias}) : 存在")
                 else:
@@ -960,16 +1265,15 @@ class Text2SQLQueryEngine:
         
         # 检查没有表别名的字段引用 - 改进逻辑
         # 对于没有表别名的字段，我们需要更谨慎地判断
-        simple_field_pattern = r'\[([^\]]+)\]'
-        simple_fields = re.findall(simple_field_pattern, sql)
-        
-        # 过滤掉已经在带别名字段中处理过的字段
+        simple_fields = _BRACKET_FIELD_RE.findall(sql)
+
+        # 过滤掉已经在带别名字段中处理过的字段（复用上面的匹配结果）
         aliased_fields = set()
-        for alias, field in re.findall(select_pattern, sql):
+        for alias, field in aliased_field_matches:
             aliased_fields.add(field)
-        for alias, field in re.findall(r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]', where_clause if where_match else ''):
+        for alias, field in where_field_matches:
             aliased_fields.add(field)
-        
+
         simple_fields = [field for field in simple_fields if field not in aliased_fields]
         
         for field in simple_fields:
@@ -979,19 +1283,13 @@ class Text2SQLQueryEngine:
             if '.' in field:
                 continue
                 
-            # 检查是否在任何表中存在
+            # 检查是否在任何表中存在（用预建字段集合索引）
             field_exists = False
-            for table_name, table_info in self.table_knowledge.items():
-                columns = []
-                for col in table_info.get('columns', []):
-                    if isinstance(col, dict) and 'name' in col:
-                        columns.append(norm_field_name(col['name']))
-                    elif isinstance(col, str):
-                        columns.append(norm_field_name(col))
-                
-                if norm_field_name(field) in columns:
+            norm_field = norm_field_name(field)
+            for orig_table, columns in column_sets.values():
+                if norm_field in columns:
                     field_exists = True
-                    field_results.append(f"表[{table_name}] 字段[{field}] (无别名) : 存在")
+                    field_results.append(f"表[{orig_table}] 字段[{field}] (无别名) : 存在")
                     break
             
             # 如果字段在任何表中都不存在，但可能是业务术语，也不报错
@@ -1012,7 +1310,7 @@ class Text2SQLQueryEngine:
                 for rel in self.relationships['relationships']:
                     desc = rel.get('description', '')
                     # 支持 =、<->、==、等于
-                    m = re.match(r'([\w]+)\.([\w\s]+)\s*(=|<->|==|等于)\s*([\w]+)\.([\w\s]+)', desc)
+                    m = _REL_DESC_RE.match(desc)
                     if m:
                         t1, f1, _, t2, f2 = m.group(1), m.group(2), m.group(3), m.group(4), m.group(5)
                         rel_list.append({
@@ -1033,7 +1331,7 @@ class Text2SQLQueryEngine:
                 # 直接是关系列表
                 for rel in self.relationships:
                     desc = rel.get('description', '')
-                    m = re.match(r'([\w]+)\.([\w\s]+)\s*(=|<->|==|等于)\s*([\w]+)\.([\w\s]+)', desc)
+                    m = _REL_DESC_RE.match(desc)
                     if m:
                         t1, f1, _, t2, f2 = m.group(1), m.group(2), m.group(3), m.group(4), m.group(5)
                         rel_list.append({
@@ -1051,9 +1349,8 @@ class Text2SQLQueryEngine:
                         })
             
             # 执行关系校验
-            join_on_pattern = r'JOIN\s+([\w\[\]\.]+)\s+([a-zA-Z0-9_]+)\s+ON\s+([^\n]+)'
-            for join_table, join_alias, on_clause in re.findall(join_on_pattern, sql, re.IGNORECASE):
-                on_pairs = re.findall(r'([a-zA-Z0-9_]+)\.\[([^\]]+)\]\s*=\s*([a-zA-Z0-9_]+)\.\[([^\]]+)\]', on_clause)
+            for join_table, join_alias, on_clause in _JOIN_ON_RE.findall(sql):
+                on_pairs = _ON_PAIR_RE.findall(on_clause)
                 for left_alias, left_field, right_alias, right_field in on_pairs:
                     left_table = alias2table.get(left_alias)
                     right_table = alias2table.get(right_alias)
@@ -1397,17 +1694,17 @@ class Text2SQLQueryEngine:
             #     return False, pd.DataFrame(), f"SQL字段验证失败：以下字段不存在于表结构中：{missing_fields_str}"
             
             if db_type == "sqlite":
-                import sqlite3
-                conn = sqlite3.connect(config["file_path"])
-                df = pd.read_sql_query(sql, conn)
-                conn.close()
+                engine = self.db_manager.get_sqlite_engine(config)
+                df = pd.read_sql_query(sql, engine)
                 return True, df, "查询执行成功"
             elif db_type == "mssql":
-                from sqlalchemy import create_engine, text
-                conn_str = self.db_manager.get_mssql_connection_string(config)
-                print(f"连接字符串: {conn_str}")
-                engine = create_engine(conn_str)
-                df = pd.read_sql_query(text(sql), engine)
+                from sqlalchemy import text
+                engine = self.db_manager.get_mssql_engine(config)
+                # 服务器端游标流式分块读取，大结果集不再一次性物化；
+                # max_row_buffer调大单次驱动fetch批量，减少往返次数
+                with engine.connect().execution_options(stream_results=True, max_row_buffer=10000) as conn:
+                    chunks = list(pd.read_sql_query(text(sql), conn, chunksize=10000))
+                df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
                 return True, df, "查询执行成功"
             else:
                 return False, pd.DataFrame(), f"不支持的数据库类型: {db_type}"
@@ -1415,26 +1712,36 @@ class Text2SQLQueryEngine:
             import traceback
             print(f"详细错误信息: {traceback.format_exc()}")
             return False, pd.DataFrame(), f"SQL执行失败: {str(e)}"
+
+    def execute_sql_iter(self, sql, db_config, chunksize=5000):
+        """流式执行SQL，逐块yield DataFrame，避免大结果集一次性物化"""
+        db_type = db_config["type"]
+        config = db_config["config"]
+
+        if db_type == "sqlite":
+            engine = self.db_manager.get_sqlite_engine(config)
+            for chunk in pd.read_sql_query(sql, engine, chunksize=chunksize):
+                yield chunk
+        elif db_type == "mssql":
+            from sqlalchemy import text
+            engine = self.db_manager.get_mssql_engine(config)
+            with engine.connect().execution_options(stream_results=True, max_row_buffer=10000) as conn:
+                for chunk in pd.read_sql_query(text(sql), conn, chunksize=chunksize):
+                    yield chunk
+        else:
+            raise ValueError(f"不支持的数据库类型: {db_type}")
+
     def visualize_result(self, df, sql, question):
         """使用LLM分析SQL结果并智能生成图表"""
         if df.empty or len(df.columns) < 2:
             return None
             
         try:
-            # 智能分析数据结构和字段类型
-            categorical_cols = []
-            numeric_cols = []
-            doi_cols = []
-            
-            for col in df.columns:
-                if df[col].dtype == 'object' or col in ['Roadmap Family', 'MTM', '产品', '型号']:
-                    categorical_cols.append(col)
-                elif df[col].dtype != 'object':
-                    if 'DOI' in col or '周转天' in col:
-                        doi_cols.append(col)
-                    else:
-                        numeric_cols.append(col)
-            
+            # 智能分析数据结构和字段类型（列结构相同时直接取缓存）
+            categorical_cols, numeric_cols, doi_cols = _classify_result_columns(
+                tuple(df.columns), tuple(str(t) for t in df.dtypes)
+            )
+
             # 构建分析提示
             analysis_prompt = f"""
 请分析以下SQL查询结果，并智能选择最佳的图表配置：
@@ -1732,14 +2039,17 @@ SQL: {sql}
             "rating": "ok"
         }
         self.historical_qa.append(qa_record)
-        
-        # 保存到文件
-        try:
-            with open("historical_qa.json", "w", encoding="utf-8") as f:
-                json.dump(self.historical_qa, f, ensure_ascii=False, indent=2)
+        self.invalidate_schema_context()
+
+        # 保存到文件：日志已存在时O(1)追加，否则首次全量写入完成迁移
+        if os.path.exists(HISTORICAL_QA_LOG):
+            saved = append_historical_qa(qa_record)
+        else:
+            saved = save_historical_qa(self.historical_qa)
+        if saved:
             print(f"✅ 已保存历史问答对: {question[:30]}...")
-        except Exception as e:
-            print(f"❌ 保存历史问答对失败: {e}")
+        else:
+            print(f"❌ 保存历史问答对失败: {question[:30]}...")
     
     def train_vanna_with_enterprise_knowledge(self, qa_examples: list = None):
         """用企业级表结构、关系、业务规则和问题-SQL对训练Vanna"""
@@ -1749,8 +2059,9 @@ SQL: {sql}
         
         try:
             print("开始用企业级知识库训练Vanna...")
-            
-            # 1. 训练表结构DDL
+
+            # 1. 训练表结构DDL（所有表合并为一次提交，避免逐表调用开销）
+            ddl_statements = []
             for table_name, table_info in self.table_knowledge.items():
                 columns = table_info.get('columns', [])
                 col_defs = []
@@ -1764,53 +2075,52 @@ SQL: {sql}
                     else:
                         continue
                     col_defs.append(f"[{col_name}] {col_type}")
-                
+
                 if col_defs:
-                    ddl = f"CREATE TABLE [{table_name}] (\n  " + ",\n  ".join(col_defs) + "\n);"
-                    self.vanna.train(ddl=ddl)
-                    print(f"训练表结构: {table_name}")
-            
-            # 2. 强化训练表关系
+                    ddl_statements.append(f"CREATE TABLE [{table_name}] (\n  " + ",\n  ".join(col_defs) + "\n);")
+
+            if ddl_statements:
+                self.vanna.train(ddl="\n\n".join(ddl_statements))
+                print(f"训练表结构: {len(ddl_statements)} 个表（批量提交）")
+
+            # 2. 强化训练表关系（所有关系和最高规则合并为一次提交）
             if self.relationships and 'relationships' in self.relationships:
                 rel_texts = []
                 for rel in self.relationships['relationships']:
                     desc = rel.get('description', '')
                     if desc:
-                        rel_text = f"表关系: {desc}"
-                        self.vanna.train(documentation=rel_text)
-                        rel_texts.append(rel_text)
-                        print(f"训练表关系: {desc}")
-                
-                # 多次强调最高规则
+                        rel_texts.append(f"表关系: {desc}")
+
                 if rel_texts:
                     rels_joined = '\n'.join(rel_texts)
-                    for _ in range(3):
-                        self.vanna.train(documentation=f"最高规则：你只能使用如下表关系JOIN，禁止其它：\n{rels_joined}")
-            
+                    self.vanna.train(
+                        documentation=f"{rels_joined}\n最高规则：你只能使用如下表关系JOIN，禁止其它：\n{rels_joined}"
+                    )
+                    print(f"训练表关系: {len(rel_texts)} 条（批量提交）")
+
             # 3. 训练业务规则
             if self.business_rules:
                 rules_text = f"业务规则: {json.dumps(self.business_rules, ensure_ascii=False)}"
                 self.vanna.train(documentation=rules_text)
                 print("训练业务规则")
-            
-            # 4. 训练历史问答对
-            if qa_examples:
-                for qa in qa_examples:
-                    q = qa.get('question')
-                    sql = qa.get('sql')
-                    if q and sql:
-                        self.vanna.train(question=q, sql=sql)
-                        print(f"训练问答对: {q[:50]}...")
-            
-            # 5. 训练现有的历史问答对
-            if self.historical_qa:
-                for qa in self.historical_qa:
-                    q = qa.get('question')
-                    sql = qa.get('sql')
-                    if q and sql:
-                        self.vanna.train(question=q, sql=sql)
-                        print(f"训练历史问答对: {q[:50]}...")
-            
+
+            # 4. 批量训练问答对（传入的示例 + 现有历史问答对，去重后一次提交）
+            qa_pairs = []
+            seen = set()
+            for qa in (qa_examples or []) + (self.historical_qa or []):
+                q = qa.get('question')
+                sql = qa.get('sql')
+                if q and sql and (q, sql) not in seen:
+                    seen.add((q, sql))
+                    qa_pairs.append({'question': q, 'sql': sql})
+
+            if qa_pairs:
+                if hasattr(self.vanna, 'train_qa_batch'):
+                    self.vanna.train_qa_batch(qa_pairs)
+                else:
+                    for qa in qa_pairs:
+                        self.vanna.train(question=qa['question'], sql=qa['sql'])
+
             print("Vanna企业级知识库训练完成")
             return True
             
@@ -1904,26 +2214,14 @@ SQL: {sql}
             "max_tokens": 2000
         }
         
-        # 创建会话以复用连接
-        session = requests.Session()
-        session.headers.update(headers)
-        
-        # 配置连接池和超时
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=10,
-            pool_maxsize=10,
-            max_retries=3
-        )
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        
         for attempt in range(max_retries):
             try:
                 print(f"正在调用DeepSeek API (尝试 {attempt + 1}/{max_retries})...")
-                
-                # 使用更保守的超时设置
-                response = session.post(
-                    "https://api.deepseek.com/v1/chat/completions",
+
+                # 使用更保守的超时设置；共享会话复用TLS连接，重试不再重新握手
+                response = _DEEPSEEK_SESSION.post(
+                    DEEPSEEK_API_URL,
+                    headers=headers,
                     json=data,
                     timeout=(30, 90)  # (连接超时, 读取超时)
                 )
@@ -1972,16 +2270,13 @@ SQL: {sql}
                     continue
                 else:
                     return f"API调用失败: {str(e)}"
-            finally:
-                # 确保会话正确关闭
-                session.close()
-        
+
         return "所有重试都失败了，请检查网络连接和API配置"
     def save_database_configs(self):
-        # 保存数据库配置到文件
+        # 保存数据库配置到文件（先写临时文件再原子替换）
         try:
-            with open("database_configs.json", "w", encoding="utf-8") as f:
-                json.dump(self.databases, f, ensure_ascii=False, indent=2)
+            atomic_write_json("database_configs.json", self.databases)
+            _bump_db_version()
             return True
         except Exception as e:
             print(f"保存数据库配置失败: {e}")
@@ -2002,8 +2297,9 @@ SQL: {sql}
     def save_business_rules(self):
         # 兼容V2.4 UI，保存到 business_rules.json
         try:
-            with open("business_rules.json", "w", encoding="utf-8") as f:
-                json.dump(self.business_rules, f, ensure_ascii=False, indent=2)
+            atomic_write_json("business_rules.json", self.business_rules)
+            self.invalidate_schema_context()
+            _bump_kb_version()
             return True
         except Exception as e:
             return False
@@ -2011,8 +2307,7 @@ SQL: {sql}
     def save_prompt_templates(self):
         # 兼容V2.4 UI，保存到 prompt_templates.json
         try:
-            with open("prompt_templates.json", "w", encoding="utf-8") as f:
-                json.dump(self.prompt_templates, f, ensure_ascii=False, indent=2)
+            atomic_write_json("prompt_templates.json", self.prompt_templates)
             return True
         except Exception as e:
             return False
@@ -2020,22 +2315,69 @@ SQL: {sql}
     def save_product_knowledge(self):
         # 兼容V2.4 UI，保存到 product_knowledge.json
         try:
-            with open("product_knowledge.json", "w", encoding="utf-8") as f:
-                json.dump(self.product_knowledge, f, ensure_ascii=False, indent=2)
+            atomic_write_json("product_knowledge.json", self.product_knowledge)
+            _bump_pk_version()
             return True
         except Exception as e:
             return False
 
-    def save_table_knowledge(self):
-        # 兼容V2.4 UI，保存到 table_knowledge.json
+    def mark_product_knowledge_dirty(self):
+        """标记产品知识库已修改但暂不落盘，供批量操作在内存中累积改动"""
+        self._pk_dirty = True
+        _bump_pk_version()
+
+    def save_product_knowledge_if_dirty(self):
+        """有未落盘改动时才序列化写文件：批量操作N次修改只写一次"""
+        if getattr(self, "_pk_dirty", False):
+            if self.save_product_knowledge():
+                self._pk_dirty = False
+                return True
+            return False
+        return True
+
+    def save_table_knowledge(self, structure_changed=True):
+        # 兼容V2.4 UI，保存到 table_knowledge.json（先写临时文件再原子替换）
+        # structure_changed=False 表示仅元数据/备注变更，不必重建表名/字段索引
         try:
-            with open("table_knowledge.json", "w", encoding="utf-8") as f:
-                json.dump(self.table_knowledge, f, ensure_ascii=False, indent=2)
+            atomic_write_json("table_knowledge.json", self.table_knowledge)
+            if structure_changed:
+                self.invalidate_table_name_index()
+            _bump_kb_version()
             return True
         except Exception as e:
             print(f"保存表结构知识库失败: {e}")
             return False
 
+    def save_table_knowledge_async(self, structure_changed=True):
+        """后台线程保存表知识库：逐表小改动不再阻塞UI，连续点击合并为一次在途+一次排队"""
+        import threading
+        if not hasattr(self, '_save_kb_lock'):
+            self._save_kb_lock = threading.Lock()
+            self._save_kb_dirty = False
+            self._save_kb_running = False
+            self._save_kb_structure = False
+
+        with self._save_kb_lock:
+            self._save_kb_dirty = True
+            self._save_kb_structure = self._save_kb_structure or structure_changed
+            if self._save_kb_running:
+                return True
+            self._save_kb_running = True
+
+        def _worker():
+            while True:
+                with self._save_kb_lock:
+                    if not self._save_kb_dirty:
+                        self._save_kb_running = False
+                        return
+                    self._save_kb_dirty = False
+                    structure = self._save_kb_structure
+                    self._save_kb_structure = False
+                self.save_table_knowledge(structure_changed=structure)
+
+        threading.Thread(target=_worker, daemon=True).start()
+        return True
+
     def load_table_knowledge(self):
         # 兼容V2.4 UI，从 table_knowledge.json 加载
         try:
@@ -2063,8 +2405,8 @@ SQL: {sql}
         
         try:
             print("使用备用API调用方法...")
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
+            response = _DEEPSEEK_SESSION.post(
+                DEEPSEEK_API_URL,
                 headers=headers,
                 json=data,
                 timeout=180  # 3分钟超时
@@ -2137,10 +2479,7 @@ if __name__ == "__main__":
     relationships = load_json('table_relationships.json')
     business_rules = load_json('business_rules.json')
     product_knowledge = load_json('product_knowledge.json')
-    try:
-        historical_qa = load_json('historical_qa.json')
-    except:
-        historical_qa = []
+    historical_qa = load_historical_qa()
     try:
         prompt_templates = load_json('prompt_templates.json')
     except:
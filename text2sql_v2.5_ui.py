@@ -1,10 +1,15 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+import io
 import json
-from text2sql_2_5_query import Text2SQLQueryEngine, DatabaseManager, VannaWrapper
+from text2sql_2_5_query import Text2SQLQueryEngine, DatabaseManager, VannaWrapper, load_historical_qa, save_historical_qa, kb_version, db_version, pk_version, load_business_rules_meta, append_business_rules_meta, atomic_write_json
 import re
 import time
+import heapq
+import itertools
+from collections import Counter
 import plotly.express as px
 import plotly.graph_objects as go
 import warnings
@@ -27,18 +32,410 @@ def save_json(data, path):
     except Exception:
         return False
 
+@st.cache_data(show_spinner=False)
+def classify_result_columns(columns, dtype_strs):
+    """按类型划分结果列：分类列、数值列、DOI列（缓存，避免每次rerun重复扫描）"""
+    categorical_cols = []
+    numeric_cols = []
+    doi_cols = []
+    for col, dtype_str in zip(columns, dtype_strs):
+        if dtype_str == 'object' or col in ['Roadmap Family', 'MTM', '产品', '型号', 'Group']:
+            categorical_cols.append(col)
+        else:
+            if 'DOI' in col or '周转天' in col:
+                doi_cols.append(col)
+            else:
+                numeric_cols.append(col)
+    return categorical_cols, numeric_cols, doi_cols
+
+# pyarrow随streamlit一起安装；一次pandas->Arrow转换供展示和CSV复用
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+@st.cache_data(show_spinner=False)
+def dataframe_to_arrow(df):
+    """结果集一次性转换为Arrow表（缓存），st.dataframe与CSV导出共用同一份"""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def show_result_dataframe(df):
+    """展示结果集：直接喂Arrow表给st.dataframe，省去内部pandas->arrow转换"""
+    if pa is not None:
+        st.dataframe(dataframe_to_arrow(df), use_container_width=True)
+    else:
+        st.dataframe(df, use_container_width=True)
+
+@st.cache_data(show_spinner=False)
+def dataframe_to_csv_bytes(df):
+    """结果集序列化为CSV字节串（缓存，同一结果集rerun时不再重复to_csv）"""
+    if pa is not None:
+        import io
+        buf = io.BytesIO()
+        pa_csv.write_csv(dataframe_to_arrow(df), buf)
+        return buf.getvalue()
+    return df.to_csv(index=False).encode('utf-8')
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_get_tables(_db_manager, db_type, config_key):
+    """表列表缓存（5分钟TTL）：rerun重绘不再往返数据库；config_key为排序JSON串保证可哈希"""
+    return _db_manager.get_tables(db_type, json.loads(config_key))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_get_table_schema(_db_manager, db_type, config_key, table_name):
+    """表结构缓存（5分钟TTL）：逐表展开时不再重复查INFORMATION_SCHEMA"""
+    return _db_manager.get_table_schema(db_type, json.loads(config_key), table_name)
+
+def db_config_cache_key(config):
+    """数据库配置转为稳定的缓存键"""
+    return json.dumps(config, sort_keys=True)
+
+@st.cache_data(ttl=120, max_entries=64, show_spinner=False)
+def cached_preview_table(_system, db_type, config_key, db_name, table_name):
+    """表数据预览缓存（2分钟TTL）：来回切换同一张表时免去重复的数据库往返"""
+    safe_table = table_name.replace("]", "").replace(";", "")
+    if db_type == "mssql":
+        preview_sql = f"SELECT TOP 5 * FROM [{safe_table}]"
+    else:
+        preview_sql = f'SELECT * FROM "{safe_table}" LIMIT 5'
+    db_config = {"type": db_type, "config": json.loads(config_key), "name": db_name}
+    return _system.execute_sql(preview_sql, db_config)
+
+@st.cache_data(show_spinner=False)
+def column_info_dataframe(column_info):
+    """字段信息转DataFrame（缓存）：同一表结构rerun时不再重建"""
+    return pd.DataFrame(column_info, columns=["序号", "字段名", "类型", "可空", "默认值", "主键"])
+
+@st.cache_data(show_spinner=False)
+def cached_business_rules_meta(json_mtime, log_mtime):
+    """术语元数据缓存：以两份落盘文件的mtime为键，文件没变的rerun不再读盘+解析。
+    cache_data返回副本，调用方可安全就地修改"""
+    return load_business_rules_meta()
+
+def business_rules_meta_mtimes():
+    def _mtime(path):
+        return os.path.getmtime(path) if os.path.exists(path) else 0.0
+    return _mtime("business_rules_meta.json"), _mtime("business_rules_meta.jsonl")
+
+# orjson为可选加速依赖：dumps约5-10x、loads约2-3x于stdlib，缺失时自动退回
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps_fast(obj):
+    """导出payload序列化：优先orjson（返回bytes，st.download_button可直接用）。
+    stdlib退路用iterencode分块写入BytesIO，避免整串str+utf-8再编码的双倍峰值内存"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    buf = io.BytesIO()
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    for chunk in encoder.iterencode(obj):
+        buf.write(chunk.encode('utf-8'))
+    return buf.getvalue()
+
+def json_loads_fast(data):
+    """导入payload反序列化：优先orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+def deferred_json_download(prepare_label, state_key, build_export, file_name_func):
+    """两段式JSON导出：点"准备导出"才序列化（平时rerun零开销），
+    payload存进session_state后下载按钮跨rerun保留。build_export/file_name_func
+    都只在点击时调用。下载工具会自行pretty-print，这里不再indent。"""
+    if st.button(prepare_label, key=state_key + "_btn"):
+        st.session_state[state_key] = (
+            json_dumps_fast(build_export()),
+            file_name_func()
+        )
+    if state_key in st.session_state:
+        payload, file_name = st.session_state[state_key]
+        st.download_button(
+            label="下载JSON文件",
+            data=payload,
+            file_name=file_name,
+            mime="application/json",
+            key=state_key + "_dl"
+        )
+
+# 产品表名关键词（预编译，单次C级扫描代替逐关键词lower+substring）
+_PRODUCT_TABLE_RE = re.compile(r'group|product|item|goods', re.IGNORECASE)
+
+# 模板变量 {xxx} 提取（预编译，模板页每次rerun要调好几次）
+_VAR_RE = re.compile(r'\{(\w+)\}')
+
+# 预设规则模板（模块级常量，免得每次rerun重建几十个dict/str）
+PRESET_RULE_TEMPLATES = {
+    "教育系统": {
+        "学生": "student", "课程": "course", "成绩": "score", "教师": "teacher",
+        "班级": "class", "姓名": "name", "年龄": "age", "性别": "gender",
+        "优秀": "score >= 90", "良好": "score >= 80 AND score < 90",
+        "及格": "score >= 60 AND score < 80", "不及格": "score < 60"
+    },
+    "电商系统": {
+        "用户": "user", "商品": "product", "订单": "order", "支付": "payment",
+        "库存": "inventory", "价格": "price", "数量": "quantity",
+        "热销": "sales_count > 100", "新品": "create_date >= DATEADD(month, -1, GETDATE())"
+    },
+    "人事系统": {
+        "员工": "employee", "部门": "department", "职位": "position",
+        "薪资": "salary", "考勤": "attendance", "绩效": "performance",
+        "在职": "status = 'active'", "离职": "status = 'inactive'"
+    }
+}
+
+# 业务规则分类关键词（模块级常量，免得每次rerun重建）；
+# frozenset视图供精确命中走O(1)，子串匹配再退回逐关键词扫描
+TERM_CATEGORIES = {
+    "实体映射": ["学生", "课程", "成绩", "教师", "班级", "用户", "商品", "订单"],
+    "字段映射": ["姓名", "性别", "年龄", "分数", "课程名称", "价格", "数量"],
+    "时间映射": ["今年", "去年", "明年", "25年", "24年", "23年"],
+    "条件映射": ["优秀", "良好", "及格", "不及格", "热销", "新品", "在职", "离职"]
+}
+_CATEGORY_KEYWORD_SETS = {category: frozenset(keywords)
+                          for category, keywords in TERM_CATEGORIES.items()}
+
+# 产品知识库的供应链核心字段（清理非核心字段时保留的键）
+PRODUCT_CORE_KEYS = ("pn", "group", "roadmap_family", "model",
+                     "create_time", "import_time", "update_time",
+                     "source", "source_table", "source_database")
+# 同一组键的frozenset视图：产品卡片过滤自定义字段时O(1)成员判断
+PRODUCT_CORE_KEY_SET = frozenset(PRODUCT_CORE_KEYS)
+
+@st.cache_resource(show_spinner=False)
+def load_product_knowledge_singleton(path="product_knowledge.json"):
+    """产品知识库进程级单例：cache_resource返回同一对象引用，不做pickle拷贝
+    （cache_data每次命中都会深拷贝大dict）。调用方就地修改后必须
+    mark_product_knowledge_dirty()推进pk_version，派生缓存才会失效。"""
+    return load_json(path)
+
+def session_cached(key, version, compute):
+    """按版本号把派生计算缓存进session_state，版本未变时rerun直接复用"""
+    if st.session_state.get(key + "_ver") != version:
+        st.session_state[key] = compute()
+        st.session_state[key + "_ver"] = version
+    return st.session_state[key]
+
+@st.cache_data(ttl=600, max_entries=50, show_spinner=False)
+def _cached_deepseek(_system, prompt):
+    """模板调试用的API调用缓存：同一提示词10分钟内复用响应，
+    反复点"测试SQL生成"不重复付网络往返（_前缀参数不参与哈希）"""
+    return _system.call_deepseek_api(prompt)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _count_vars(content):
+    """模板去重变量数（缓存：同一模板内容rerun时不再重扫正则）"""
+    return len(set(_VAR_RE.findall(content)))
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _required_vars(content):
+    """模板必填变量集合（缓存，预览前做集合差集校验用）"""
+    return frozenset(_VAR_RE.findall(content))
+
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def _load_template_metadata(mtime):
+    """模板元数据缓存读取：mtime作缓存键，文件没变rerun不再开文件解析JSON"""
+    with open("template_metadata.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def knowledge_preview_json(cache_key, version, data, limit):
+    """知识库测试数据预览串：islice只取前几条（不整表物化items），
+    并按版本号缓存，rerun时不再重复JSON编码"""
+    return session_cached(cache_key, version, lambda: json.dumps(
+        dict(itertools.islice(data.items(), limit)),
+        ensure_ascii=False, indent=2) if data else "{}")
+
+@st.cache_data(show_spinner=False)
+def _tables_lower(tables):
+    """表名小写化结果缓存：同一表列表只做一次lower，逐键输入不再重复转换"""
+    return [t.lower() for t in tables]
+
+@st.cache_data(show_spinner=False)
+def filter_tables(tables, search_term):
+    """按关键词筛选表名（缓存，同一列表+关键词不重复扫描）"""
+    term = search_term.lower()
+    return [t for t, tl in zip(tables, _tables_lower(tables)) if term in tl]
+
+@st.cache_resource(show_spinner=False)
+def _load_prompt_templates_file(mtime, path):
+    """提示词模板缓存读取：mtime进缓存键，save_prompt_templates重写文件后自动失效"""
+    return load_json(path)
+
+def load_prompt_templates_cached(path="prompt_templates.json"):
+    """main()每次rerun都要模板dict，文件没变时直接复用已解析对象"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    return _load_prompt_templates_file(mtime, path)
+
+@st.cache_resource(show_spinner=False)
+def _get_db_manager():
+    """DatabaseManager进程级单例：引擎池本就按连接串全局复用
+    （_get_pooled_engine），这里再免掉每次rerun重建管理器对象"""
+    return DatabaseManager()
+
+# st.fragment：局部rerun，旧版streamlit不支持时退化为普通函数（整页rerun）
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+@_fragment
+def show_history_qa_panel(system):
+    """历史问答对面板（fragment局部渲染，删除/清空不触发整页rerun）"""
+    st.subheader("历史问答对")
+    # 显示历史问答对统计
+    qa_count = len(system.historical_qa)
+    st.metric("历史问答对数量", qa_count)
+
+    # 历史问答对查看功能
+    if system.historical_qa:
+        st.subheader("最近的历史问答对")
+
+        # 添加删除功能
+        col_qa_header1, col_qa_header2 = st.columns([3, 1])
+        with col_qa_header1:
+            st.write(f"共 {len(system.historical_qa)} 条记录")
+        with col_qa_header2:
+            if st.button("🗑️ 清空所有", key="clear_all_qa"):
+                if st.session_state.get("confirm_clear_qa", False):
+                    system.historical_qa = []
+                    if save_historical_qa(system.historical_qa):
+                        st.success("✅ 已清空所有历史问答对")
+                        st.rerun()
+                else:
+                    st.session_state["confirm_clear_qa"] = True
+                    st.warning("⚠️ 再次点击确认清空")
+
+        # 显示历史问答对，支持删除单个
+        for i, qa in enumerate(system.historical_qa[-10:]):  # 显示最近10条
+            col_qa1, col_qa2 = st.columns([4, 1])
+            with col_qa1:
+                with st.expander(f"Q{i+1}: {qa['question'][:50]}...", expanded=False):
+                    st.write(f"**问题:** {qa['question']}")
+                    st.code(qa['sql'], language="sql")
+                    st.caption(f"时间: {qa.get('timestamp', '未知')}")
+            with col_qa2:
+                if st.button(f"删除", key=f"delete_qa_{i}"):
+                    if st.session_state.get(f"confirm_delete_qa_{i}", False):
+                        # 删除指定索引的记录
+                        actual_index = len(system.historical_qa) - 10 + i
+                        if 0 <= actual_index < len(system.historical_qa):
+                            del system.historical_qa[actual_index]
+                            if save_historical_qa(system.historical_qa):
+                                st.success("✅ 已删除该记录")
+                                st.rerun()
+                    else:
+                        st.session_state[f"confirm_delete_qa_{i}"] = True
+                        st.warning("⚠️ 再次点击确认删除")
+    else:
+        st.info("暂无历史问答对")
+
+@_fragment
+def render_kb_table_editor(system, table_name):
+    """知识库单表编辑器（fragment局部渲染：编辑一个表只重跑该表的expander）"""
+    table_info = system.table_knowledge.get(table_name)
+    if table_info is None:
+        return
+    with st.expander(f"🧠 {table_name} (知识库)", expanded=False):
+        col_kb1, col_kb2 = st.columns([2, 1])
+
+        with col_kb1:
+            # V2.3增强：数据库和Schema可编辑
+            current_db = table_info.get("database", "")
+            new_db = st.text_input("所属数据库:", value=current_db, key=f"db_{table_name}")
+
+            current_schema = table_info.get("schema", "dbo")
+            new_schema = st.text_input("所属Schema:", value=current_schema, key=f"schema_{table_name}")
+
+            # 表备注编辑
+            current_comment = table_info.get("comment", "")
+            new_comment = st.text_area(
+                "表备注:",
+                value=current_comment,
+                key=f"comment_{table_name}",
+                height=100
+            )
+
+            if st.button(f"保存元数据", key=f"save_meta_{table_name}"):
+                system.table_knowledge[table_name]["database"] = new_db
+                system.table_knowledge[table_name]["schema"] = new_schema
+                system.table_knowledge[table_name]["comment"] = new_comment
+                # 仅元数据变更，不重建引擎侧的表名/字段索引
+                system.save_table_knowledge_async(structure_changed=False)
+                st.success("元数据已保存")
+                st.rerun()
+
+            # 字段备注编辑：单个data_editor表格代替逐列text_input，百列表也只有一个控件
+            st.write("**字段备注:**")
+            business_fields = table_info.get("business_fields", {})
+            columns = table_info.get("columns", [])
+
+            fields_df = pd.DataFrame({
+                "字段名": columns,
+                "备注": [business_fields.get(c, "") for c in columns]
+            })
+            edited_df = st.data_editor(
+                fields_df,
+                key=f"fields_{table_name}",
+                num_rows="fixed",
+                disabled=["字段名"],
+                use_container_width=True,
+                hide_index=True
+            )
+
+            # 先做一次diff，无变更时禁用保存按钮，避免无效的全量序列化
+            new_fields = {
+                row.字段名: row.备注
+                for row in edited_df.itertuples(index=False)
+                if row.备注
+            }
+            fields_changed = new_fields != business_fields
+            if st.button(f"保存字段备注", key=f"save_fields_{table_name}", disabled=not fields_changed):
+                system.table_knowledge[table_name]["business_fields"] = new_fields
+                # 字段备注不影响表名/字段索引
+                system.save_table_knowledge_async(structure_changed=False)
+                st.success("字段备注已保存")
+                st.rerun()
+
+        with col_kb2:
+            # 表信息
+            st.write(f"**字段数量**: {len(table_info.get('columns', []))}")
+            st.write(f"**关联数量**: {len(table_info.get('relationships', []))}")
+
+            import_time = table_info.get("import_time", "未知")
+            update_time = table_info.get("update_time", "")
+            st.write(f"**导入时间**: {import_time}")
+            if update_time:
+                st.write(f"**更新时间**: {update_time}")
+
+            # 删除表
+            if st.button(f"删除", key=f"del_kb_{table_name}"):
+                if st.session_state.get(f"confirm_del_{table_name}", False):
+                    del system.table_knowledge[table_name]
+                    system.save_table_knowledge()
+                    st.success(f"已删除表 {table_name}")
+                    st.rerun()
+                else:
+                    st.session_state[f"confirm_del_{table_name}"] = True
+                    st.warning("再次点击确认删除")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def check_network_status():
+    """网络可达性探测（缓存30秒：同步网络往返不再每次rerun都阻塞UI线程；
+    HEAD免响应体，超时收紧到2秒）"""
+    try:
+        import requests
+        requests.head("https://api.deepseek.com", timeout=2)
+        return True, "网络连接正常"
+    except Exception as e:
+        return False, f"网络连接异常: {str(e)}"
+
 def show_sql_query_page_v25(system):
     st.header("智能SQL查询 V2.5 (2.5_query内核)")
-    
-    # 网络状态检查
-    def check_network_status():
-        try:
-            import requests
-            response = requests.get("https://api.deepseek.com", timeout=5)
-            return True, "网络连接正常"
-        except Exception as e:
-            return False, f"网络连接异常: {str(e)}"
-    
+
     # 显示网络状态
     network_ok, network_msg = check_network_status()
     if network_ok:
@@ -79,13 +476,9 @@ def show_sql_query_page_v25(system):
             if question:
                 # 合并SQL生成和执行过程
                 with st.spinner("正在处理查询..."):
-                    # 尝试从问题中识别目标表
-                    target_table = None
-                    for table_name in system.table_knowledge.keys():
-                        if table_name.lower() in question.lower():
-                            target_table = table_name
-                            break
-                    
+                    # 尝试从问题中识别目标表（预建索引，单次扫描）
+                    target_table = system.detect_target_table(question)
+
                     prompt = system.generate_prompt(question, target_table)
                     
                     # 增加错误处理
@@ -179,27 +572,17 @@ def show_sql_query_page_v25(system):
                                 
                                 # 显示查询结果
                                 st.subheader("查询结果")
-                                st.dataframe(df, use_container_width=True)
+                                show_result_dataframe(df)
                                 
                                 # 可视化
                                 if not df.empty:
                                     st.subheader("数据可视化")
                                     
-                                    # 智能识别字段类型
-                                    categorical_cols = []
-                                    numeric_cols = []
-                                    doi_cols = []
-                                    doi_columns = []  # 添加这个变量以确保兼容性
-                                    
-                                    for col in df.columns:
-                                        if df[col].dtype == 'object' or col in ['Roadmap Family', 'MTM', '产品', '型号', 'Group']:
-                                            categorical_cols.append(col)
-                                        elif df[col].dtype != 'object':
-                                            if 'DOI' in col or '周转天' in col:
-                                                doi_cols.append(col)
-                                                doi_columns.append(col)  # 同时填充两个变量
-                                            else:
-                                                numeric_cols.append(col)
+                                    # 智能识别字段类型（缓存结果，列结构相同时直接复用）
+                                    categorical_cols, numeric_cols, doi_cols = classify_result_columns(
+                                        tuple(df.columns), tuple(str(t) for t in df.dtypes)
+                                    )
+                                    doi_columns = list(doi_cols)  # 添加这个变量以确保兼容性
                                     
                                     # 智能选择X轴（优先选择分类字段）
                                     if categorical_cols:
@@ -257,21 +640,29 @@ def show_sql_query_page_v25(system):
                                     
                                     chart_title = generate_chart_title(question, df)
                                     
-                                    import plotly.graph_objects as go
+                                    # 大结果集优化：柱状图先按X轴聚合降采样，折线图改用WebGL渲染
+                                    large_result = len(df) > 2000
+                                    df_plot = df
+                                    if large_result and selected_bars:
+                                        agg_cols = list(selected_bars)
+                                        if selected_line:
+                                            agg_cols.append(selected_line)
+                                        df_plot = df.groupby(x_axis_col, as_index=False)[agg_cols].sum()
+                                    scatter_cls = go.Scattergl if large_result else go.Scatter
                                     if selected_bars and selected_line:
                                         fig = go.Figure()
                                         # 柱状图
                                         for bar in selected_bars:
                                             fig.add_trace(go.Bar(
-                                                x=df[x_axis_col],
-                                                y=df[bar],
+                                                x=df_plot[x_axis_col],
+                                                y=df_plot[bar],
                                                 name=bar,
                                                 yaxis='y1'
                                             ))
                                         # 折线图
-                                        fig.add_trace(go.Scatter(
-                                            x=df[x_axis_col],
-                                            y=df[selected_line],
+                                        fig.add_trace(scatter_cls(
+                                            x=df_plot[x_axis_col],
+                                            y=df_plot[selected_line],
                                             name=selected_line,
                                             yaxis='y2',
                                             mode='lines+markers',
@@ -289,8 +680,8 @@ def show_sql_query_page_v25(system):
                                         fig = go.Figure()
                                         for bar in selected_bars:
                                             fig.add_trace(go.Bar(
-                                                x=df[x_axis_col],
-                                                y=df[bar],
+                                                x=df_plot[x_axis_col],
+                                                y=df_plot[bar],
                                                 name=bar
                                             ))
                                         fig.update_layout(title=chart_title, xaxis=dict(title=x_axis_col), yaxis=dict(title='数值'))
@@ -298,8 +689,8 @@ def show_sql_query_page_v25(system):
                                     else:
                                         st.info("请至少选择一个库存类指标。")
                                 
-                                # 下载功能
-                                csv = df.to_csv(index=False)
+                                # 下载功能（序列化结果缓存，避免每次渲染都重新生成CSV）
+                                csv = dataframe_to_csv_bytes(df)
                                 st.download_button("下载CSV", csv, "query_results.csv", "text/csv")
                                 
                                 # 智能分析并存储到session state
@@ -342,54 +733,9 @@ def show_sql_query_page_v25(system):
             else:
                 st.warning("请输入问题")
     with col2:
-        st.subheader("历史问答对")
-        # 显示历史问答对统计
-        qa_count = len(system.historical_qa)
-        st.metric("历史问答对数量", qa_count)
-        
-        # 历史问答对查看功能
-        if system.historical_qa:
-            st.subheader("最近的历史问答对")
-            
-            # 添加删除功能
-            col_qa_header1, col_qa_header2 = st.columns([3, 1])
-            with col_qa_header1:
-                st.write(f"共 {len(system.historical_qa)} 条记录")
-            with col_qa_header2:
-                if st.button("🗑️ 清空所有", key="clear_all_qa"):
-                    if st.session_state.get("confirm_clear_qa", False):
-                        system.historical_qa = []
-                        if save_json(system.historical_qa, 'historical_qa.json'):
-                            st.success("✅ 已清空所有历史问答对")
-                            st.rerun()
-                    else:
-                        st.session_state["confirm_clear_qa"] = True
-                        st.warning("⚠️ 再次点击确认清空")
-            
-            # 显示历史问答对，支持删除单个
-            for i, qa in enumerate(system.historical_qa[-10:]):  # 显示最近10条
-                col_qa1, col_qa2 = st.columns([4, 1])
-                with col_qa1:
-                    with st.expander(f"Q{i+1}: {qa['question'][:50]}...", expanded=False):
-                        st.write(f"**问题:** {qa['question']}")
-                        st.code(qa['sql'], language="sql")
-                        st.caption(f"时间: {qa.get('timestamp', '未知')}")
-                with col_qa2:
-                    if st.button(f"删除", key=f"delete_qa_{i}"):
-                        if st.session_state.get(f"confirm_delete_qa_{i}", False):
-                            # 删除指定索引的记录
-                            actual_index = len(system.historical_qa) - 10 + i
-                            if 0 <= actual_index < len(system.historical_qa):
-                                del system.historical_qa[actual_index]
-                                if save_json(system.historical_qa, 'historical_qa.json'):
-                                    st.success("✅ 已删除该记录")
-                                    st.rerun()
-                        else:
-                            st.session_state[f"confirm_delete_qa_{i}"] = True
-                            st.warning("⚠️ 再次点击确认删除")
-        else:
-            st.info("暂无历史问答对")
-        
+        # 历史问答对面板（fragment局部渲染）
+        show_history_qa_panel(system)
+
         # 新增：Vanna训练功能
         st.subheader("Vanna训练")
         if st.button("训练Vanna (使用历史问答对)", type="secondary"):
@@ -421,11 +767,11 @@ def main():
             table_knowledge=load_json('table_knowledge.json'),
             relationships=load_json('table_relationships.json'),
             business_rules=load_json('business_rules.json'),
-            product_knowledge=load_json('product_knowledge.json'),
-            historical_qa=load_json('historical_qa.json') if os.path.exists('historical_qa.json') else [],
+            product_knowledge=load_product_knowledge_singleton(),
+            historical_qa=load_historical_qa(),
             vanna=VannaWrapper(),
-            db_manager=DatabaseManager(),
-            prompt_templates=load_json('prompt_templates.json') if os.path.exists('prompt_templates.json') else {}
+            db_manager=_get_db_manager(),
+            prompt_templates=load_prompt_templates_cached()
         )
         # 加载数据库配置
         system.load_database_configs()
@@ -997,10 +1343,21 @@ def show_database_management_page_v23(system):
         # V2.3新增：数据库性能统计
         st.subheader("数据库统计")
         
-        total_dbs = len(system.databases)
-        active_dbs = len([db for db in system.databases.values() if db.get("active", False)])
-        mssql_count = len([db for db in system.databases.values() if db["type"] == "mssql"])
-        sqlite_count = len([db for db in system.databases.values() if db["type"] == "sqlite"])
+        def _count_db_stats():
+            # 单次遍历同时统计激活数和各类型数量，不做四次独立扫描
+            active = mssql = sqlite = 0
+            for db in system.databases.values():
+                if db.get("active", False):
+                    active += 1
+                if db["type"] == "mssql":
+                    mssql += 1
+                elif db["type"] == "sqlite":
+                    sqlite += 1
+            return len(system.databases), active, mssql, sqlite
+
+        total_dbs, active_dbs, mssql_count, sqlite_count = session_cached(
+            "dbm_stats", db_version(), _count_db_stats
+        )
         
         st.metric("总数据库", total_dbs)
         st.metric("已激活", active_dbs)
@@ -1012,14 +1369,22 @@ def show_database_management_page_v23(system):
         
         if st.button("测试所有连接"):
             with st.spinner("正在测试所有数据库连接..."):
-                for db_id, db_config in system.databases.items():
-                    start_time = time.time()
+                # 各库连接测试相互独立，并发执行后按配置顺序展示结果
+                from concurrent.futures import ThreadPoolExecutor
+
+                def _timed_test(db_config):
+                    start_time = time.perf_counter()
                     success, msg = system.db_manager.test_connection(
-                        db_config["type"], 
+                        db_config["type"],
                         db_config["config"]
                     )
-                    test_time = time.time() - start_time
-                    
+                    return success, msg, time.perf_counter() - start_time
+
+                db_items = list(system.databases.items())
+                with ThreadPoolExecutor(max_workers=min(len(db_items), 16) or 1) as executor:
+                    results = list(executor.map(lambda item: _timed_test(item[1]), db_items))
+
+                for (db_id, db_config), (success, msg, test_time) in zip(db_items, results):
                     if success:
                         st.success(f"{db_config['name']}: {msg} ({test_time:.2f}s)")
                     else:
@@ -1042,9 +1407,12 @@ def show_database_management_page_v23(system):
 def show_table_management_page_v23(system):
     """表结构管理页面 V2.3 - 完整功能版"""
     st.header("表结构管理 V2.3")
-    
-    # 选择数据库
-    active_dbs = {k: v for k, v in system.databases.items() if v.get("active", False)}
+
+    # 选择数据库（按配置版本缓存，rerun不重算）
+    active_dbs = session_cached(
+        "tm_active_dbs", db_version(),
+        lambda: {k: v for k, v in system.databases.items() if v.get("active", False)}
+    )
     
     if not active_dbs:
         st.warning("请先在数据库管理中激活至少一个数据库")
@@ -1068,7 +1436,9 @@ def show_table_management_page_v23(system):
         if selected_db:
             with st.spinner("正在获取表列表..."):
                 start_time = time.time()
-                tables = system.db_manager.get_tables(db_config["type"], db_config["config"])
+                tables = cached_get_tables(
+                    system.db_manager, db_config["type"], db_config_cache_key(db_config["config"])
+                )
                 load_time = time.time() - start_time
         
         if tables:
@@ -1077,7 +1447,7 @@ def show_table_management_page_v23(system):
             # 表筛选功能
             st.subheader("表筛选")
             search_term = st.text_input("搜索表名:", placeholder="输入表名关键词")
-            filtered_tables = [t for t in tables if search_term.lower() in t.lower()] if search_term else tables
+            filtered_tables = filter_tables(tables, search_term) if search_term else tables
             
             # 显示筛选结果
             if search_term:
@@ -1100,8 +1470,10 @@ def show_table_management_page_v23(system):
                 with table_container:
                     for i, table in enumerate(tables_to_show):
                         with st.expander(f"📋 {table}", expanded=False):
-                            # 表结构信息
-                            schema = system.db_manager.get_table_schema(db_config["type"], db_config["config"], table)
+                            # 表结构信息（带缓存）
+                            schema = cached_get_table_schema(
+                                system.db_manager, db_config["type"], db_config_cache_key(db_config["config"]), table
+                            )
                             if schema:
                                 st.write(f"**字段数**: {len(schema['columns'])}")
                                 st.write(f"**字段列表**: {', '.join(schema['columns'][:5])}{'...' if len(schema['columns']) > 5 else ''}")
@@ -1113,7 +1485,7 @@ def show_table_management_page_v23(system):
                                         system.table_knowledge[table]["columns"] = schema["columns"]
                                         system.table_knowledge[table]["column_info"] = schema["column_info"]
                                         system.table_knowledge[table]["update_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                                        system.save_table_knowledge()
+                                        system.save_table_knowledge_async()
                                         st.success(f"表 {table} 结构已更新")
                                         st.rerun()
                                 else:
@@ -1129,7 +1501,7 @@ def show_table_management_page_v23(system):
                                             "database": db_config["config"].get("database") or db_config["config"].get("db") or "",
                                             "schema": "dbo",
                                         }
-                                        system.save_table_knowledge()
+                                        system.save_table_knowledge_async()
                                         st.success(f"表 {table} 已导入知识库")
                                         st.rerun()
                             else:
@@ -1147,24 +1519,26 @@ def show_table_management_page_v23(system):
                 if st.button("导入所有表到知识库"):
                     imported_count = 0
                     with st.spinner("正在批量导入表结构..."):
-                        for table in filtered_tables:
-                            if table not in system.table_knowledge:
-                                schema = system.db_manager.get_table_schema(
-                                    db_config["type"], db_config["config"], table
-                                )
-                                if schema:
-                                    system.table_knowledge[table] = {
-                                        "columns": schema["columns"],
-                                        "column_info": schema["column_info"],
-                                        "comment": f"从{db_config['name']}自动导入",
-                                        "relationships": [],
-                                        "business_fields": {},
-                                        "import_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-                                        "database": db_config["config"].get("database") or db_config["config"].get("db") or "",
-                                        "schema": "dbo",
-                                    }
-                                    imported_count += 1
-                        
+                        # 一次INFORMATION_SCHEMA查询批量取全部表结构，再逐表写入知识库
+                        tables_to_import = [t for t in filtered_tables if t not in system.table_knowledge]
+                        schemas = system.db_manager.get_all_schemas(
+                            db_config["type"], db_config["config"], tables_to_import
+                        )
+                        for table in tables_to_import:
+                            schema = schemas.get(table)
+                            if schema:
+                                system.table_knowledge[table] = {
+                                    "columns": schema["columns"],
+                                    "column_info": schema["column_info"],
+                                    "comment": f"从{db_config['name']}自动导入",
+                                    "relationships": [],
+                                    "business_fields": {},
+                                    "import_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    "database": db_config["config"].get("database") or db_config["config"].get("db") or "",
+                                    "schema": "dbo",
+                                }
+                                imported_count += 1
+
                         if imported_count > 0:
                             system.save_table_knowledge()
                             st.success(f"成功导入 {imported_count} 个表到知识库")
@@ -1176,17 +1550,22 @@ def show_table_management_page_v23(system):
                 if st.button("自动生成表关联"):
                     relationships_count = 0
                     with st.spinner("正在分析表关联关系..."):
-                        for table1 in system.table_knowledge:
-                            for table2 in system.table_knowledge:
-                                if table1 >= table2:  # 避免重复
-                                    continue
-                                
-                                cols1 = system.table_knowledge[table1]["columns"]
-                                cols2 = system.table_knowledge[table2]["columns"]
-                                
-                                # 查找相同字段名
-                                common_fields = set(cols1) & set(cols2)
-                                for field in common_fields:
+                        # 倒排索引：字段名 -> 表列表，避免两两比对所有表
+                        from collections import defaultdict
+                        field_to_tables = defaultdict(list)
+                        for table, info in system.table_knowledge.items():
+                            for field in info.get("columns", []):
+                                field_to_tables[field].append(table)
+
+                        existing_rels = set()
+                        for field, tabs in field_to_tables.items():
+                            for i in range(len(tabs)):
+                                for j in range(i + 1, len(tabs)):
+                                    table1, table2 = sorted((tabs[i], tabs[j]))
+                                    rel_key = (table1, table2, field)
+                                    if rel_key in existing_rels:
+                                        continue
+                                    existing_rels.add(rel_key)
                                     rel = {
                                         "table1": table1,
                                         "table2": table2,
@@ -1196,17 +1575,12 @@ def show_table_management_page_v23(system):
                                         "description": f"{table1}.{field} = {table2}.{field}",
                                         "confidence": 0.8
                                     }
-                                    
+
                                     # 添加到两个表的关系中
-                                    if "relationships" not in system.table_knowledge[table1]:
-                                        system.table_knowledge[table1]["relationships"] = []
-                                    if "relationships" not in system.table_knowledge[table2]:
-                                        system.table_knowledge[table2]["relationships"] = []
-                                    
-                                    system.table_knowledge[table1]["relationships"].append(rel)
-                                    system.table_knowledge[table2]["relationships"].append(rel)
+                                    system.table_knowledge[table1].setdefault("relationships", []).append(rel)
+                                    system.table_knowledge[table2].setdefault("relationships", []).append(rel)
                                     relationships_count += 1
-                        
+
                         system.save_table_knowledge()
                         st.success(f"自动生成 {relationships_count} 个表关联关系")
                         st.rerun()
@@ -1237,11 +1611,9 @@ def show_table_management_page_v23(system):
             
             for i, table in enumerate(filtered_tables[:display_count]):
                 with st.expander(f"📊 {table}", expanded=False):
-                    # 获取表结构
-                    schema = system.db_manager.get_table_schema(
-                        db_config["type"], 
-                        db_config["config"], 
-                        table
+                    # 获取表结构（带缓存）
+                    schema = cached_get_table_schema(
+                        system.db_manager, db_config["type"], db_config_cache_key(db_config["config"]), table
                     )
                     
                     if schema:
@@ -1250,8 +1622,7 @@ def show_table_management_page_v23(system):
                         with col_info:
                             st.write("**字段信息:**")
                             if schema["column_info"]:
-                                df_columns = pd.DataFrame(schema["column_info"], 
-                                                        columns=["序号", "字段名", "类型", "可空", "默认值", "主键"])
+                                df_columns = column_info_dataframe(schema["column_info"])
                                 st.dataframe(df_columns, use_container_width=True)
                         
                         with col_action:
@@ -1268,7 +1639,7 @@ def show_table_management_page_v23(system):
                                         "database": db_config["config"].get("database") or db_config["config"].get("db") or "",
                                         "schema": "dbo",
                                     }
-                                    system.save_table_knowledge()
+                                    system.save_table_knowledge_async()
                                     st.success(f"表 {table} 已导入知识库")
                                     st.rerun()
                             else:
@@ -1277,7 +1648,7 @@ def show_table_management_page_v23(system):
                                     system.table_knowledge[table]["columns"] = schema["columns"]
                                     system.table_knowledge[table]["column_info"] = schema["column_info"]
                                     system.table_knowledge[table]["update_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                                    system.save_table_knowledge()
+                                    system.save_table_knowledge_async()
                                     st.success(f"表 {table} 结构已更新")
                                     st.rerun()
         else:
@@ -1298,100 +1669,36 @@ def show_table_management_page_v23(system):
             sorted_tables = sorted(system.table_knowledge.items(), key=lambda x: x[0])
             
             for table_name, table_info in sorted_tables:
-                with st.expander(f"🧠 {table_name} (知识库)", expanded=False):
-                    col_kb1, col_kb2 = st.columns([2, 1])
-                    
-                    with col_kb1:
-                        # V2.3增强：数据库和Schema可编辑
-                        current_db = table_info.get("database", "")
-                        new_db = st.text_input("所属数据库:", value=current_db, key=f"db_{table_name}")
-                        
-                        current_schema = table_info.get("schema", "dbo")
-                        new_schema = st.text_input("所属Schema:", value=current_schema, key=f"schema_{table_name}")
-
-                        # 表备注编辑
-                        current_comment = table_info.get("comment", "")
-                        new_comment = st.text_area(
-                            "表备注:", 
-                            value=current_comment, 
-                            key=f"comment_{table_name}",
-                            height=100
-                        )
-                        
-                        if st.button(f"保存元数据", key=f"save_meta_{table_name}"):
-                            system.table_knowledge[table_name]["database"] = new_db
-                            system.table_knowledge[table_name]["schema"] = new_schema
-                            system.table_knowledge[table_name]["comment"] = new_comment
-                            system.save_table_knowledge()
-                            st.success("元数据已保存")
-                            st.rerun()
-                        
-                        # 字段备注编辑
-                        st.write("**字段备注:**")
-                        business_fields = table_info.get("business_fields", {})
-                        
-                        for column in table_info.get("columns", []):
-                            current_field_comment = business_fields.get(column, "")
-                            new_field_comment = st.text_input(
-                                f"{column}:", 
-                                value=current_field_comment,
-                                key=f"field_{table_name}_{column}"
-                            )
-                            
-                            if new_field_comment != current_field_comment:
-                                business_fields[column] = new_field_comment
-                        
-                        if st.button(f"保存字段备注", key=f"save_fields_{table_name}"):
-                            system.table_knowledge[table_name]["business_fields"] = business_fields
-                            system.save_table_knowledge()
-                            st.success("字段备注已保存")
-                            st.rerun()
-                    
-                    with col_kb2:
-                        # 表信息
-                        st.write(f"**字段数量**: {len(table_info.get('columns', []))}")
-                        st.write(f"**关联数量**: {len(table_info.get('relationships', []))}")
-                        
-                        import_time = table_info.get("import_time", "未知")
-                        update_time = table_info.get("update_time", "")
-                        st.write(f"**导入时间**: {import_time}")
-                        if update_time:
-                            st.write(f"**更新时间**: {update_time}")
-                        
-                        # 删除表
-                        if st.button(f"删除", key=f"del_kb_{table_name}"):
-                            if st.session_state.get(f"confirm_del_{table_name}", False):
-                                del system.table_knowledge[table_name]
-                                system.save_table_knowledge()
-                                st.success(f"已删除表 {table_name}")
-                                st.rerun()
-                            else:
-                                st.session_state[f"confirm_del_{table_name}"] = True
-                                st.warning("再次点击确认删除")
+                render_kb_table_editor(system, table_name)
         else:
             st.info("知识库为空，请先导入表结构")
         
         # 表关联管理
         st.subheader("表关联管理")
         
-        # 收集所有表关联关系
-        all_relationships = []
-        for table_name, table_info in system.table_knowledge.items():
-            for rel in table_info.get("relationships", []):
-                # 避免重复显示
-                rel_key = f"{rel.get('table1', '')}_{rel.get('table2', '')}_{rel.get('field1', '')}_{rel.get('field2', '')}"
-                if rel_key not in [r.get("key", "") for r in all_relationships]:
-                    rel_display = {
-                        "key": rel_key,
-                        "表1": rel.get("table1", ""),
-                        "字段1": rel.get("field1", ""),
-                        "表2": rel.get("table2", ""),
-                        "字段2": rel.get("field2", ""),
-                        "类型": "手工" if rel.get("type") == "manual" else "自动",
-                        "描述": rel.get("description", ""),
-                        "置信度": rel.get("confidence", 1.0)
-                    }
-                    all_relationships.append(rel_display)
+        # 收集所有表关联关系（set去重，并按知识库版本缓存，rerun不重新聚合）
+        def _collect_relationships():
+            collected = []
+            seen_rel_keys = set()
+            for table_name, table_info in system.table_knowledge.items():
+                for rel in table_info.get("relationships", []):
+                    # 避免重复显示
+                    rel_key = f"{rel.get('table1', '')}_{rel.get('table2', '')}_{rel.get('field1', '')}_{rel.get('field2', '')}"
+                    if rel_key not in seen_rel_keys:
+                        seen_rel_keys.add(rel_key)
+                        collected.append({
+                            "key": rel_key,
+                            "表1": rel.get("table1", ""),
+                            "字段1": rel.get("field1", ""),
+                            "表2": rel.get("table2", ""),
+                            "字段2": rel.get("field2", ""),
+                            "类型": "手工" if rel.get("type") == "manual" else "自动",
+                            "描述": rel.get("description", ""),
+                            "置信度": rel.get("confidence", 1.0)
+                        })
+            return collected
+
+        all_relationships = session_cached("tm_all_relationships", kb_version(), _collect_relationships)
         
         if all_relationships:
             st.write(f"**共 {len(all_relationships)} 个关联关系**")
@@ -1401,47 +1708,37 @@ def show_table_management_page_v23(system):
             df_display = df_relationships[["表1", "字段1", "表2", "字段2", "类型", "置信度", "描述"]]
             st.dataframe(df_display, use_container_width=True)
             
-            # 删除关联关系（改进布局：删除按钮和关系信息在同一行）
+            # 删除关联关系：多选+单按钮代替每行8列布局，控件数量与关系数无关
             st.write("**删除关联关系:**")
-            for idx, rel in enumerate(all_relationships):
-                # 使用列布局，将删除按钮和关系信息放在同一行
-                col1, col2, col3, col4, col5, col6, col7, col8 = st.columns([2, 1, 2, 1, 1, 1, 3, 1])
-                
-                with col1:
-                    st.write(f"**{rel['表1']}**")
-                with col2:
-                    st.write(f"→ {rel['字段1']}")
-                with col3:
-                    st.write(f"**{rel['表2']}**")
-                with col4:
-                    st.write(f"→ {rel['字段2']}")
-                with col5:
-                    st.write(f"({rel['类型']})")
-                with col6:
-                    st.write(f"{rel['置信度']:.1f}")
-                with col7:
-                    st.write(f"*{rel['描述']}*")
-                with col8:
-                    if st.button(f"删除", key=f"del_rel_{rel['key']}", type="secondary"):
-                        # 删除该关联关系（从所有涉及表中删除）
-                        for t in [rel["表1"], rel["表2"]]:
-                            if t in system.table_knowledge:
-                                system.table_knowledge[t]["relationships"] = [
-                                    r for r in system.table_knowledge[t]["relationships"]
-                                    if not (
-                                        r.get("table1") == rel["表1"] and
-                                        r.get("table2") == rel["表2"] and
-                                        r.get("field1") == rel["字段1"] and
-                                        r.get("field2") == rel["字段2"]
-                                    )
-                                ]
-                        
-                        system.save_table_knowledge()
-                        st.success(f"已删除关联关系: {rel['表1']}.{rel['字段1']} ↔ {rel['表2']}.{rel['字段2']}")
-                        st.rerun()
-                
-                # 添加分隔线
-                st.divider()
+            rel_by_key = {rel["key"]: rel for rel in all_relationships}
+            selected_rel_keys = st.multiselect(
+                "选择要删除的关联:",
+                options=list(rel_by_key.keys()),
+                format_func=lambda k: (
+                    f"{rel_by_key[k]['表1']}.{rel_by_key[k]['字段1']} ↔ "
+                    f"{rel_by_key[k]['表2']}.{rel_by_key[k]['字段2']} ({rel_by_key[k]['类型']})"
+                ),
+                key="del_rel_select"
+            )
+            if st.button("批量删除选中关联", type="secondary", disabled=not selected_rel_keys):
+                # 先汇总所有待删关系，再对全部表做一次过滤+一次保存
+                tombstones = {
+                    (
+                        rel_by_key[key]["表1"], rel_by_key[key]["表2"],
+                        rel_by_key[key]["字段1"], rel_by_key[key]["字段2"]
+                    )
+                    for key in selected_rel_keys
+                }
+                for table_info in system.table_knowledge.values():
+                    rels = table_info.get("relationships")
+                    if rels:
+                        table_info["relationships"] = [
+                            r for r in rels
+                            if (r.get("table1"), r.get("table2"), r.get("field1"), r.get("field2")) not in tombstones
+                        ]
+                system.save_table_knowledge()
+                st.success(f"已删除 {len(selected_rel_keys)} 个关联关系")
+                st.rerun()
             # 删除全部
             if st.button("清空所有关联"):
                 if st.session_state.get("confirm_clear_rel", False):
@@ -1540,25 +1837,27 @@ def show_table_management_page_v23(system):
         st.subheader("快速操作")
         
         if st.button("刷新表列表"):
+            # 清空表列表/表结构缓存后重新拉取
+            cached_get_tables.clear()
+            cached_get_table_schema.clear()
             st.rerun()
         
-        if st.button("导出知识库"):
-            export_data = {
+        deferred_json_download(
+            "导出知识库", "export_table_kb",
+            lambda: {
                 "table_knowledge": system.table_knowledge,
                 "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
                 "database": db_config["name"]
-            }
-            
-            st.download_button(
-                label="下载JSON文件",
-                data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                file_name=f"table_knowledge_{db_config['name']}.json",
-                mime="application/json"
-            )
+            },
+            lambda: f"table_knowledge_{db_config['name']}.json"
+        )
 
 def show_product_knowledge_page_v23(system):
     """产品知识库页面 V2.3 - 完整功能版"""
     st.header("产品知识库 V2.3")
+
+    # 单次渲染只取一次时间戳（秒级粒度足够），批量循环里不再反复strftime
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
     
     col1, col2 = st.columns([2, 1])
     
@@ -1568,9 +1867,12 @@ def show_product_knowledge_page_v23(system):
         # 从数据库导入产品信息
         st.write("**从数据库导入产品信息:**")
         
-        # 选择数据库
-        active_dbs = {k: v for k, v in system.databases.items() if v.get("active", False)}
-        
+        # 选择数据库（按配置版本缓存，rerun不重算）
+        active_dbs = session_cached(
+            "pk_active_dbs", db_version(),
+            lambda: {k: v for k, v in system.databases.items() if v.get("active", False)}
+        )
+
         if active_dbs:
             selected_db = st.selectbox(
                 "选择数据库:",
@@ -1581,11 +1883,10 @@ def show_product_knowledge_page_v23(system):
             
             db_config = active_dbs[selected_db]
             
-            # 检查可用的表
-            with st.spinner("正在获取表列表..."):
-                tables = system.db_manager.get_tables(db_config["type"], db_config["config"])
-            
-            # product_tables = [t for t in tables if any(keyword in t.lower() for keyword in ['group', 'product', 'item', 'goods'])]
+            # 检查可用的表（带缓存，避免每次rerun都查库）
+            tables = cached_get_tables(system.db_manager, db_config["type"], db_config_cache_key(db_config["config"]))
+
+            # product_tables = list(filter(_PRODUCT_TABLE_RE.search, tables))
             product_tables = tables  # 放开限制，允许选择所有表
             
             if product_tables:
@@ -1598,9 +1899,12 @@ def show_product_knowledge_page_v23(system):
                 with col_preview:
                     if st.button("预览表数据"):
                         try:
-                            preview_sql = f"SELECT TOP 5 * FROM [{selected_table}]" if db_config["type"] == "mssql" else f"SELECT * FROM {selected_table} LIMIT 5"
-                            success, df, msg = system.execute_sql(preview_sql, db_config)
-                            
+                            success, df, msg = cached_preview_table(
+                                system, db_config["type"],
+                                db_config_cache_key(db_config["config"]),
+                                db_config["name"], selected_table
+                            )
+
                             if success and not df.empty:
                                 st.write("**表数据预览:**")
                                 st.dataframe(df)
@@ -1612,45 +1916,74 @@ def show_product_knowledge_page_v23(system):
                 with col_import:
                     if st.button("导入产品信息"):
                         try:
-                            with st.spinner("正在导入产品信息..."):
-                                # 查询产品信息
-                                import_sql = f"SELECT * FROM [{selected_table}]" if db_config["type"] == "mssql" else f"SELECT * FROM {selected_table}"
-                                success, df, msg = system.execute_sql(import_sql, db_config)
-                                
-                                if success and not df.empty:
-                                    # 保存到产品知识库
-                                    if "products" not in system.product_knowledge:
-                                        system.product_knowledge["products"] = {}
-                                    
-                                    imported_count = 0
-                                    for _, row in df.iterrows():
-                                        product_id = str(row.iloc[0])  # 假设第一列是ID
-                                        
-                                        # 只保留供应链核心字段，其他作为自定义字段
-                                        product_data = {
-                                            "pn": str(row.iloc[0]) if len(row) > 0 else "",
-                                            "group": str(row.iloc[1]) if len(row) > 1 else "",
-                                            "roadmap_family": str(row.iloc[2]) if len(row) > 2 else "",
-                                            "model": str(row.iloc[3]) if len(row) > 3 else "",
-                                            "import_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-                                            "source_table": selected_table,
-                                            "source_database": db_config["name"],
-                                            "source": "import"
-                                        }
-                                        
-                                        # 将其他字段作为自定义字段
-                                        for i, (col_name, value) in enumerate(row.items()):
-                                            if i > 3 and pd.notna(value):  # 跳过前4个核心字段
-                                                product_data[f"field_{col_name}"] = str(value)
-                                        
-                                        system.product_knowledge["products"][product_id] = product_data
-                                        imported_count += 1
-                                    
+                            # 流式导入：逐块读取，内存占用与表大小无关
+                            import_sql = f"SELECT * FROM [{selected_table}]" if db_config["type"] == "mssql" else f"SELECT * FROM {selected_table}"
+
+                            if "products" not in system.product_knowledge:
+                                system.product_knowledge["products"] = {}
+
+                            import_time = now
+                            progress = st.progress(0, text="正在导入产品信息...")
+                            imported_count = 0
+                            first_chunk = None
+
+                            for chunk_idx, df in enumerate(system.execute_sql_iter(import_sql, db_config)):
+                                if df.empty:
+                                    continue
+                                if first_chunk is None:
+                                    first_chunk = df.head()
+
+                                # 向量化构建：一次性转成字符串记录，避免iterrows逐行装箱
+                                core_cols = list(df.columns[:4])
+                                extra_cols = list(df.columns[4:])
+                                core_records = df[core_cols].fillna('').astype(str).to_dict('records')
+                                if extra_cols:
+                                    # 列式切片：notna掩码+astype(str)各做一次C级运算，
+                                    # 行内只遍历非空位置，不再逐格pd.notna
+                                    extra_df = df[extra_cols]
+                                    extra_mask = extra_df.notna().to_numpy()
+                                    extra_vals = extra_df.astype(str).to_numpy()
+                                    extra_names = [f"field_{c}" for c in extra_cols]
+
+                                for row_idx, core in enumerate(core_records):
+                                    product_id = core[core_cols[0]]  # 假设第一列是ID
+
+                                    # 只保留供应链核心字段，其他作为自定义字段
+                                    product_data = {
+                                        "pn": core[core_cols[0]] if len(core_cols) > 0 else "",
+                                        "group": core[core_cols[1]] if len(core_cols) > 1 else "",
+                                        "roadmap_family": core[core_cols[2]] if len(core_cols) > 2 else "",
+                                        "model": core[core_cols[3]] if len(core_cols) > 3 else "",
+                                        "import_time": import_time,
+                                        "source_table": selected_table,
+                                        "source_database": db_config["name"],
+                                        "source": "import"
+                                    }
+
+                                    # 将其他字段作为自定义字段（只取非空单元格）
+                                    if extra_cols:
+                                        for j in np.flatnonzero(extra_mask[row_idx]):
+                                            product_data[extra_names[j]] = extra_vals[row_idx, j]
+
+                                    system.product_knowledge["products"][product_id] = product_data
+                                    imported_count += 1
+
+                                # 每10个块落盘一次，中断时不至于全部丢失
+                                if (chunk_idx + 1) % 10 == 0:
                                     system.save_product_knowledge()
-                                    st.success(f"成功导入 {imported_count} 个产品信息")
-                                    st.dataframe(df.head())
-                                else:
-                                    st.error(f"导入失败: {msg}")
+                                # 总块数未知：单调爬到满格后停住，行数文字才是准确进度
+                                progress.progress(min((chunk_idx + 1) / 100, 1.0),
+                                                  text=f"已导入 {imported_count} 条...")
+
+                            if imported_count > 0:
+                                system.save_product_knowledge()
+                                progress.progress(1.0, text="导入完成")
+                                st.success(f"成功导入 {imported_count} 个产品信息")
+                                if first_chunk is not None:
+                                    st.dataframe(first_chunk)
+                            else:
+                                progress.empty()
+                                st.error("导入失败: 表中没有数据")
                         except Exception as e:
                             st.error(f"导入失败: {e}")
             else:
@@ -1709,7 +2042,7 @@ def show_product_knowledge_page_v23(system):
                         "group": group,
                         "roadmap_family": roadmap_family,
                         "model": model,
-                        "create_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                        "create_time": now,
                         "source": "manual"
                     }
                     
@@ -1737,29 +2070,33 @@ def show_product_knowledge_page_v23(system):
             with col_search:
                 search_term = st.text_input("搜索产品:", placeholder="输入产品名称或ID")
             
+            # 过滤索引（按pk_version缓存）：id/pn小写表 + group倒排，免得每次按键全量扫描
+            products = system.product_knowledge["products"]
+
+            def _build_product_filter_index():
+                lower_index = {pid: (pid.lower(), p.get('pn', '').lower()) for pid, p in products.items()}
+                by_group = {}
+                for pid, p in products.items():
+                    by_group.setdefault(p.get('group', ''), []).append(pid)
+                return lower_index, by_group
+
+            lower_index, by_group = session_cached("pk_filter_index", pk_version(), _build_product_filter_index)
+
             with col_filter:
-                all_categories = set()
-                for product in system.product_knowledge["products"].values():
-                    if product.get("group"):
-                        all_categories.add(product["group"])
-                
-                filter_category = st.selectbox("筛选分类:", ["全部"] + list(all_categories))
-            
-            # 过滤产品
-            filtered_products = {}
-            for product_id, product_info in system.product_knowledge["products"].items():
-                # 搜索过滤
-                if search_term:
-                    if (search_term.lower() not in product_id.lower() and 
-                        search_term.lower() not in product_info.get('pn', '').lower()):
-                        continue
-                
-                # 分类过滤
-                if filter_category != "全部":
-                    if product_info.get('group') != filter_category:
-                        continue
-                
-                filtered_products[product_id] = product_info
+                all_categories = sorted(g for g in by_group if g)
+                filter_category = st.selectbox("筛选分类:", ["全部"] + all_categories)
+
+            # 过滤产品：无搜索词且不限分类时直接复用原dict（O(1)），否则先按分类缩小候选集再做小写子串匹配
+            if not search_term and filter_category == "全部":
+                filtered_products = products
+            else:
+                candidates = products.keys() if filter_category == "全部" else by_group.get(filter_category, [])
+                term = search_term.lower() if search_term else ""
+                filtered_products = {
+                    pid: products[pid]
+                    for pid in candidates
+                    if not term or term in lower_index[pid][0] or term in lower_index[pid][1]
+                }
             
             st.write(f"**显示 {len(filtered_products)} / {len(system.product_knowledge['products'])} 个产品**")
             
@@ -1768,39 +2105,41 @@ def show_product_knowledge_page_v23(system):
                 col_batch1, col_batch2, col_batch3, col_batch4 = st.columns(4)
                 
                 with col_batch1:
-                    if st.button("导出选中产品"):
-                        export_data = {
+                    deferred_json_download(
+                        "导出选中产品", "export_filtered_products",
+                        lambda: {
                             "products": filtered_products,
-                            "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "export_time": now,
                             "total_count": len(filtered_products)
-                        }
-                        
-                        st.download_button(
-                            label="下载JSON文件",
-                            data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                            file_name=f"products_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                            mime="application/json"
-                        )
+                        },
+                        lambda: f"products_{time.strftime('%Y%m%d_%H%M%S')}.json"
+                    )
                 
                 with col_batch2:
                     if st.button("批量更新Model"):
                         new_model = st.text_input("新Model:", key="batch_model")
                         if st.button("确认更新"):
+                            products = system.product_knowledge["products"]
                             for product_id in filtered_products:
-                                system.product_knowledge["products"][product_id]["model"] = new_model
-                                system.product_knowledge["products"][product_id]["update_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                            
-                            system.save_product_knowledge()
+                                product = products[product_id]
+                                product["model"] = new_model
+                                product["update_time"] = now
+                            system.mark_product_knowledge_dirty()
+
+                            system.save_product_knowledge_if_dirty()
                             st.success(f"已更新 {len(filtered_products)} 个产品Model")
                             st.rerun()
                 
                 with col_batch3:
                     if st.button("批量删除"):
                         if st.session_state.get("confirm_batch_delete", False):
-                            for product_id in filtered_products:
-                                del system.product_knowledge["products"][product_id]
-                            
-                            system.save_product_knowledge()
+                            # 集合差+字典推导一次性重建：删多数时按保留数收费，且替换是原子的
+                            products = system.product_knowledge["products"]
+                            kept = products.keys() - filtered_products.keys()
+                            system.product_knowledge["products"] = {k: products[k] for k in kept}
+                            system.mark_product_knowledge_dirty()
+
+                            system.save_product_knowledge_if_dirty()
                             st.success(f"已删除 {len(filtered_products)} 个产品")
                             st.session_state["confirm_batch_delete"] = False
                             st.rerun()
@@ -1811,35 +2150,32 @@ def show_product_knowledge_page_v23(system):
                 with col_batch4:
                     if st.button("清理非核心字段"):
                         cleaned_count = 0
+                        products = system.product_knowledge["products"]
                         for product_id in filtered_products:
-                            product_info = system.product_knowledge["products"][product_id]
-                            # 只保留供应链核心字段
-                            cleaned_product = {
-                                "pn": product_info.get("pn", ""),
-                                "group": product_info.get("group", ""),
-                                "roadmap_family": product_info.get("roadmap_family", ""),
-                                "model": product_info.get("model", ""),
-                                "create_time": product_info.get("create_time", ""),
-                                "import_time": product_info.get("import_time", ""),
-                                "update_time": product_info.get("update_time", ""),
-                                "source": product_info.get("source", ""),
-                                "source_table": product_info.get("source_table", ""),
-                                "source_database": product_info.get("source_database", "")
+                            product_info = products[product_id]
+                            # 只保留供应链核心字段 + 自定义字段（以field_开头）
+                            products[product_id] = {
+                                **{k: product_info.get(k, "") for k in PRODUCT_CORE_KEYS},
+                                **{k: v for k, v in product_info.items() if k.startswith("field_")}
                             }
-                            # 保留自定义字段（以field_开头的字段）
-                            for key, value in product_info.items():
-                                if key.startswith("field_"):
-                                    cleaned_product[key] = value
-                            
-                            system.product_knowledge["products"][product_id] = cleaned_product
                             cleaned_count += 1
-                        
-                        system.save_product_knowledge()
+                        system.mark_product_knowledge_dirty()
+
+                        system.save_product_knowledge_if_dirty()
                         st.success(f"已清理 {cleaned_count} 个产品的非核心字段")
                         st.rerun()
             
-            # 显示产品列表
-            for product_id, product_info in filtered_products.items():
+            # 显示产品列表（分页：每次rerun只渲染当前页的50个expander，widget数量与产品总量无关）
+            page_size = 50
+            total_pages = max(1, -(-len(filtered_products) // page_size))
+            if total_pages > 1:
+                page = st.number_input("页码:", min_value=1, max_value=total_pages, value=1,
+                                       key="product_list_page")
+            else:
+                page = 1
+            page_items = list(filtered_products.items())[(page - 1) * page_size: page * page_size]
+
+            for product_id, product_info in page_items:
                 with st.expander(f"🏷️ {product_info.get('pn', product_id)} (ID: {product_id})"):
                     col_info, col_action = st.columns([3, 1])
                     
@@ -1865,9 +2201,8 @@ def show_product_knowledge_page_v23(system):
                             st.write(f"**数据来源**: {source}")
                         
                         # 自定义字段
-                        custom_fields = {k: v for k, v in product_info.items() 
-                                       if k not in ['pn', 'group', 'roadmap_family', 'model', 
-                                                   'create_time', 'import_time', 'update_time', 'source', 'source_table', 'source_database']}
+                        custom_fields = {k: v for k, v in product_info.items()
+                                         if k not in PRODUCT_CORE_KEY_SET}
                         
                         if custom_fields:
                             st.write("**自定义字段**:")
@@ -1884,7 +2219,8 @@ def show_product_knowledge_page_v23(system):
                         if st.button(f"删除", key=f"del_product_{product_id}"):
                             if st.session_state.get(f"confirm_del_product_{product_id}", False):
                                 del system.product_knowledge["products"][product_id]
-                                system.save_product_knowledge()
+                                system.mark_product_knowledge_dirty()
+                                system.save_product_knowledge_if_dirty()
                                 st.success(f"已删除产品 {product_id}")
                                 st.rerun()
                             else:
@@ -1910,10 +2246,11 @@ def show_product_knowledge_page_v23(system):
                                         'group': new_group,
                                         'roadmap_family': new_roadmap_family,
                                         'model': new_model,
-                                        'update_time': time.strftime("%Y-%m-%d %H:%M:%S")
+                                        'update_time': now
                                     })
-                                    
-                                    system.save_product_knowledge()
+                                    system.mark_product_knowledge_dirty()
+
+                                    system.save_product_knowledge_if_dirty()
                                     st.session_state[f"editing_product_{product_id}"] = False
                                     st.success("产品信息已更新")
                                     st.rerun()
@@ -1951,7 +2288,7 @@ def show_product_knowledge_page_v23(system):
                         "action": rule_action,
                         "priority": rule_priority,
                         "status": rule_status,
-                        "create_time": time.strftime("%Y-%m-%d %H:%M:%S")
+                        "create_time": now
                     }
                     
                     if system.save_product_knowledge():
@@ -2035,56 +2372,48 @@ def show_product_knowledge_page_v23(system):
         product_count = len(system.product_knowledge.get("products", {}))
         rule_count = len(system.product_knowledge.get("business_rules", {}))
         
-        # 分类统计
-        category_count = {}
-        status_count = {}
-        
-        for product in system.product_knowledge.get("products", {}).values():
-            category = product.get("category", "未分类")
-            status = product.get("status", "未知")
-            
-            category_count[category] = category_count.get(category, 0) + 1
-            status_count[status] = status_count.get(status, 0) + 1
-        
+        # 分类统计：单趟Counter，按pk_version缓存，知识库没变的rerun零计数
+        def _build_pk_stats():
+            product_values = system.product_knowledge.get("products", {}).values()
+            return (Counter(p.get("category", "未分类") for p in product_values),
+                    Counter(p.get("status", "未知") for p in product_values))
+
+        category_count, status_count = session_cached("pk_stats", pk_version(), _build_pk_stats)
+
         st.metric("产品总数", product_count)
         st.metric("业务规则数", rule_count)
         st.metric("产品分类数", len(category_count))
-        
-        # 分类分布
+
+        # 分布明细合并成一条markdown：一个元素代替逐行st.write，减小每次rerun的websocket负载
+        distribution_md = []
         if category_count:
-            st.write("**分类分布:**")
-            for category, count in category_count.items():
-                st.write(f"- {category}: {count}")
-        
-        # 状态分布
+            distribution_md.append("**分类分布:**\n\n| 分类 | 数量 |\n|---|---|")
+            distribution_md.extend(f"| {category} | {count} |" for category, count in category_count.most_common())
         if status_count:
-            st.write("**状态分布:**")
-            for status, count in status_count.items():
-                st.write(f"- {status}: {count}")
+            distribution_md.append("\n**状态分布:**\n\n| 状态 | 数量 |\n|---|---|")
+            distribution_md.extend(f"| {status} | {count} |" for status, count in status_count.most_common())
+        if distribution_md:
+            st.markdown("\n".join(distribution_md))
         
         # 数据管理
         st.subheader("数据管理")
         
-        if st.button("导出完整知识库"):
-            export_data = {
+        deferred_json_download(
+            "导出完整知识库", "export_full_product_kb",
+            lambda: {
                 "product_knowledge": system.product_knowledge,
-                "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "export_time": now,
                 "version": "V2.3"
-            }
-            
-            st.download_button(
-                label="下载JSON文件",
-                data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                file_name=f"product_knowledge_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json"
-            )
+            },
+            lambda: f"product_knowledge_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
         
         # 导入知识库
         uploaded_file = st.file_uploader("导入知识库", type=['json'])
         if uploaded_file is not None:
             try:
-                import_data = json.load(uploaded_file)
-                
+                import_data = json_loads_fast(uploaded_file.getvalue())
+
                 if st.button("确认导入"):
                     if "product_knowledge" in import_data:
                         system.product_knowledge.update(import_data["product_knowledge"])
@@ -2109,6 +2438,421 @@ def show_product_knowledge_page_v23(system):
                 st.session_state["confirm_clear_product_kb"] = True
                 st.warning("再次点击确认清空")
 
+@_fragment
+def show_rules_browser(system):
+    """现有术语映射浏览器（fragment局部渲染：搜索/筛选只重跑本片段，不整页rerun）"""
+    # 显示现有术语映射
+    st.subheader("现有术语映射")
+
+    # 搜索和过滤
+    col_search, col_filter, col_sort = st.columns(3)
+
+    with col_search:
+        search_term = st.text_input("搜索规则:", placeholder="输入业务术语或数据库术语")
+
+    with col_filter:
+        # 加载元数据（全量JSON + JSONL增量日志，按文件mtime缓存）
+        system.business_rules_meta = cached_business_rules_meta(*business_rules_meta_mtimes())
+    
+        all_types = set()
+        all_tables = set()
+        for meta in system.business_rules_meta.values():
+            if meta.get("type"):
+                all_types.add(meta["type"])
+            if meta.get("table_restriction"):
+                all_tables.add(meta["table_restriction"])
+    
+        filter_type = st.selectbox("筛选类型:", ["全部"] + list(all_types))
+        filter_table = st.selectbox("筛选表限制:", ["全部"] + list(all_tables))
+
+    with col_sort:
+        sort_by = st.selectbox("排序方式:", ["按术语", "按类型", "按创建时间"])
+
+    # 类型/表限制倒排索引（按元数据文件mtime缓存）：选框过滤用集合交集缩小候选集
+    def _build_meta_indexes():
+        type_to_terms = {}
+        table_to_terms = {}
+        for term, meta in system.business_rules_meta.items():
+            type_to_terms.setdefault(meta.get("type", ""), set()).add(term)
+            table_to_terms.setdefault(meta.get("table_restriction", ""), set()).add(term)
+        return type_to_terms, table_to_terms
+
+    type_to_terms, table_to_terms = session_cached(
+        "br_meta_indexes", business_rules_meta_mtimes(), _build_meta_indexes)
+
+    # 小写索引（按kb_version缓存）：搜索时不再每个按键对每条规则做lower()
+    lower_rules = session_cached(
+        "br_lower_rules", kb_version(),
+        lambda: {term: (term.lower(), str(mapping).lower())
+                 for term, mapping in system.business_rules.items()}
+    )
+
+    # 过滤+排序一趟完成：meta只取一次进元组，排序直接比元组列，
+    # 不再在比较器里反复查元数据字典；结果按条件组合缓存进session_state
+    def _build_filtered_rules():
+        needle = search_term.lower() if search_term else ""
+        meta_get = system.business_rules_meta.get
+
+        candidates = None
+        if filter_type != "全部":
+            candidates = type_to_terms.get(filter_type, set())
+        if filter_table != "全部":
+            by_table = table_to_terms.get(filter_table, set())
+            candidates = by_table if candidates is None else candidates & by_table
+
+        if candidates is None:
+            items = system.business_rules.items()
+        else:
+            rules_get = system.business_rules.get
+            items = ((term, rules_get(term)) for term in candidates if term in system.business_rules)
+
+        rows = []
+        for term, mapping in items:
+            if needle:
+                lower_term, lower_mapping = lower_rules.get(term) or (term.lower(), str(mapping).lower())
+                if needle not in lower_term and needle not in lower_mapping:
+                    continue
+            meta = meta_get(term, {})
+            rows.append((term, mapping, meta.get("type", ""), meta.get("create_time", "")))
+
+        if sort_by == "按类型":
+            rows.sort(key=lambda row: row[2])
+        elif sort_by == "按创建时间":
+            rows.sort(key=lambda row: row[3], reverse=True)
+        else:  # 按术语
+            rows.sort(key=lambda row: row[0])
+        return {term: mapping for term, mapping, _, _ in rows}
+
+    filtered_rules = session_cached(
+        "br_filtered_rules",
+        (kb_version(), search_term, filter_type, filter_table, sort_by),
+        _build_filtered_rules
+    )
+
+    # 把筛选后的数量带出fragment，侧栏"显示规则数"指标要用
+    st.session_state["br_filtered_count"] = len(filtered_rules)
+    st.write(f"**显示 {len(filtered_rules)} / {len(system.business_rules)} 条规则**")
+
+    # 没有匹配时直接收尾：不再空转四个分类桶和其他规则循环
+    if not filtered_rules:
+        st.info("无匹配规则")
+        return
+
+    # 批量操作
+    if filtered_rules:
+        col_batch1, col_batch2, col_batch3 = st.columns(3)
+    
+        with col_batch1:
+            deferred_json_download(
+                "导出选中规则", "export_filtered_rules",
+                lambda: {
+                    "business_rules": filtered_rules,
+                    "metadata": {k: v for k, v in system.business_rules_meta.items() if k in filtered_rules},
+                    "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "total_count": len(filtered_rules)
+                },
+                lambda: f"business_rules_{time.strftime('%Y%m%d_%H%M%S')}.json"
+            )
+    
+        with col_batch2:
+            if st.button("批量删除选中"):
+                if st.session_state.get("confirm_batch_delete_rules", False):
+                    # 一次性重建代替逐键del：按存活数收费且替换原子
+                    doomed = set(filtered_rules)
+                    for term in doomed & system.business_rules_meta.keys():
+                        append_business_rules_meta(term, None)
+                    system.business_rules = {
+                        k: v for k, v in system.business_rules.items() if k not in doomed}
+                    system.business_rules_meta = {
+                        k: v for k, v in system.business_rules_meta.items() if k not in doomed}
+
+                    system.save_business_rules()
+                    st.success(f"已删除 {len(filtered_rules)} 条规则")
+                    st.session_state["confirm_batch_delete_rules"] = False
+                    st.rerun()
+                else:
+                    st.session_state["confirm_batch_delete_rules"] = True
+                    st.warning("再次点击确认批量删除")
+    
+        with col_batch3:
+            if st.button("验证所有规则"):
+                with st.spinner("正在验证规则..."):
+                    # 向量化校验：pandas .str一次性算三个布尔列，C层跑完不再逐条Python判断
+                    validation_df = pd.DataFrame({
+                        "术语": list(filtered_rules),
+                        "映射": [str(m) for m in filtered_rules.values()]
+                    })
+                    term_empty = validation_df["术语"].str.strip().eq("")
+                    map_empty = validation_df["映射"].str.strip().eq("")
+                    too_long = validation_df["术语"].str.len() > 50
+
+                    issue_parts = [
+                        np.where(term_empty, "业务术语为空", ""),
+                        np.where(map_empty, "数据库术语为空", ""),
+                        np.where(too_long, "业务术语过长", ""),
+                    ]
+                    joined = [
+                        "; ".join(p for p in parts if p)
+                        for parts in zip(*issue_parts)
+                    ]
+                    has_issue = term_empty | map_empty | too_long
+                    validation_df["状态"] = np.where(has_issue, "❌ 异常", "✅ 正常")
+                    validation_df["问题"] = joined
+
+                    st.write("**验证结果:**")
+                    st.dataframe(validation_df, use_container_width=True)
+
+    # 分类显示规则
+    term_categories = TERM_CATEGORIES
+
+    # 单趟分桶：每条规则只扫一遍关键词，同时记录已分类集合，
+    # 未分类规则直接取补集，不再对全量规则做第二遍子串扫描
+    meta_type_to_category = {"实体": "实体映射", "字段": "字段映射",
+                             "时间": "时间映射", "条件": "条件映射"}
+    category_buckets = {category: {} for category in term_categories}
+    category_buckets["__other__"] = {}
+    for term, mapping in filtered_rules.items():
+        meta_type = system.business_rules_meta.get(term, {}).get("type", "")
+        meta_category = meta_type_to_category.get(meta_type)
+        hit = False
+        for category, keywords in term_categories.items():
+            if (category == meta_category
+                    or term in _CATEGORY_KEYWORD_SETS[category]
+                    or any(keyword in term for keyword in keywords)):
+                category_buckets[category][term] = mapping
+                hit = True
+        if not hit:
+            category_buckets["__other__"][term] = mapping
+
+    # 表选项提到渲染循环外：每次rerun只建一次列表，索引用dict O(1)查
+    available_tables = list(system.table_knowledge.keys()) if system.table_knowledge else []
+    table_options = ["全部表"] + available_tables
+    table_index_map = {t: i + 1 for i, t in enumerate(available_tables)}
+
+    for category, keywords in term_categories.items():
+        category_rules = category_buckets[category]
+
+        if category_rules:
+            st.write(f"📂 {category} ({len(category_rules)}条)")
+            # 单个data_editor网格代替每条规则的控件群：每类O(5N)个widget降为1个
+            grid_rows = []
+            for term, rule_info in category_rules.items():
+                if isinstance(rule_info, dict):
+                    grid_rows.append({
+                        "键": term,
+                        "业务术语": rule_info.get('business_term', term),
+                        "数据库字段": rule_info.get('db_field', ''),
+                        "条件类型": rule_info.get('condition_type', '等于'),
+                        "条件值": rule_info.get('condition_value', ''),
+                        "表限制": rule_info.get('table') or "全部表",
+                        "规则类型": rule_info.get('type', '实体'),
+                        "描述": rule_info.get('description', ''),
+                        "删除": False,
+                    })
+                else:
+                    # 旧格式规则（字符串映射）
+                    grid_rows.append({
+                        "键": term, "业务术语": term, "数据库字段": rule_info,
+                        "条件类型": '等于', "条件值": '', "表限制": "全部表",
+                        "规则类型": '实体', "描述": '', "删除": False,
+                    })
+
+            rules_df = pd.DataFrame(grid_rows)
+            edited_df = st.data_editor(
+                rules_df,
+                key=f"rules_editor_{category}",
+                num_rows="fixed",
+                disabled=["键"],
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "条件类型": st.column_config.SelectboxColumn(options=["等于", "包含", "正则"]),
+                    "表限制": st.column_config.SelectboxColumn(options=table_options),
+                    "规则类型": st.column_config.SelectboxColumn(options=["实体", "字段", "条件", "时间"]),
+                    "删除": st.column_config.CheckboxColumn(),
+                }
+            )
+
+            # 先diff，无变更时禁用保存按钮；提交时一趟算出更新/删除
+            grid_changed = not edited_df.equals(rules_df)
+            if st.button("保存更改", key=f"save_rules_{category}", disabled=not grid_changed):
+                now_str = time.strftime("%Y-%m-%d %H:%M:%S")
+                original_rows = {row["键"]: row for row in grid_rows}
+                for row in edited_df.to_dict('records'):
+                    term = row["键"]
+                    if row["删除"]:
+                        system.business_rules.pop(term, None)
+                        if term in system.business_rules_meta:
+                            del system.business_rules_meta[term]
+                            append_business_rules_meta(term, None)
+                        continue
+                    if row == original_rows[term]:
+                        continue
+                    table_restriction = row["表限制"] if row["表限制"] != "全部表" else None
+                    new_rule = {
+                        "business_term": row["业务术语"],
+                        "db_field": row["数据库字段"],
+                        "condition_type": row["条件类型"],
+                        "condition_value": row["条件值"],
+                        "table": table_restriction,
+                        "type": row["规则类型"],
+                        "description": row["描述"],
+                        "update_time": now_str,
+                    }
+                    # 术语改名时按原规则生成新键
+                    if row["业务术语"] != original_rows[term]["业务术语"]:
+                        del system.business_rules[term]
+                        new_key = f"{row['表限制']}_{row['业务术语']}" if table_restriction else row["业务术语"]
+                    else:
+                        new_key = term
+                    system.business_rules[new_key] = new_rule
+                    if new_key in system.business_rules_meta:
+                        system.business_rules_meta[new_key].update({
+                            "type": row["规则类型"],
+                            "table_restriction": table_restriction,
+                            "description": row["描述"],
+                            "update_time": now_str,
+                        })
+                        append_business_rules_meta(new_key, system.business_rules_meta[new_key])
+                if system.save_business_rules():
+                    st.success("✅ 规则已更新")
+                    st.rerun()
+                else:
+                    st.error("❌ 保存失败")
+
+    # 其他未分类规则：分桶时已顺手放进__other__桶
+    other_rules = category_buckets["__other__"]
+
+    if other_rules:
+        with st.expander(f"📂 其他规则 ({len(other_rules)}条)"):
+            for term, rule_info in other_rules.items():
+                # 处理新的业务规则格式（字典）
+                if isinstance(rule_info, dict):
+                    business_term = rule_info.get('business_term', term)
+                    db_field = rule_info.get('db_field', '')
+                    condition_type = rule_info.get('condition_type', '等于')
+                    condition_value = rule_info.get('condition_value', '')
+                    table_restriction = rule_info.get('table', '')
+                    rule_type = rule_info.get('type', '实体')
+                    description = rule_info.get('description', '')
+                else:
+                    # 处理旧的业务规则格式（字符串）
+                    business_term = term
+                    db_field = rule_info
+                    condition_type = '等于'
+                    condition_value = ''
+                    table_restriction = ''
+                    rule_type = '实体'
+                    description = ''
+            
+                # 创建编辑表单
+                with st.container():
+                    st.write(f"**编辑规则: {business_term}**")
+                    col_edit1, col_edit2 = st.columns(2)
+
+                    with col_edit1:
+                        new_business_term = st.text_input("业务术语:", value=business_term, key=f"other_edit_term_{term}")
+                        new_db_field = st.text_input("数据库字段:", value=db_field, key=f"other_edit_field_{term}")
+                        new_condition_type = st.selectbox("条件类型:", ["等于", "包含", "正则"], index=["等于", "包含", "正则"].index(condition_type), key=f"other_edit_condition_type_{term}")
+                        new_condition_value = st.text_input("条件值:", value=condition_value, key=f"other_edit_condition_value_{term}")
+                    with col_edit2:
+                        current_table_index = table_index_map.get(table_restriction, 0)
+                        new_table_restriction = st.selectbox("表限制:", table_options, index=current_table_index, key=f"other_edit_table_{term}")
+                        new_rule_type = st.selectbox("规则类型:", ["实体", "字段", "条件", "时间"], index=["实体", "字段", "条件", "时间"].index(rule_type), key=f"other_edit_type_{term}")
+                        new_description = st.text_input("描述:", value=description, key=f"other_edit_desc_{term}")
+
+                    col_btn1, col_btn2, col_btn3 = st.columns(3)
+
+                    with col_btn1:
+                        if st.button("保存更改", key=f"other_save_{term}"):
+                            # 创建新的规则对象
+                            new_rule = {
+                                "business_term": new_business_term,
+                                "db_field": new_db_field,
+                                "condition_type": new_condition_type,
+                                "condition_value": new_condition_value,
+                                "table": new_table_restriction if new_table_restriction != "全部表" else None,
+                                "type": new_rule_type,
+                                "description": new_description,
+                                "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
+                            }
+
+                            # 如果术语改变了，需要更新键
+                            if new_business_term != business_term:
+                                del system.business_rules[term]
+                                new_key = f"{new_table_restriction}_{new_business_term}" if new_table_restriction != "全部表" else new_business_term
+                            else:
+                                new_key = term
+
+                            system.business_rules[new_key] = new_rule
+
+                            # 更新元数据
+                            if new_key in system.business_rules_meta:
+                                system.business_rules_meta[new_key].update({
+                                    "type": new_rule_type,
+                                    "table_restriction": new_table_restriction if new_table_restriction != "全部表" else None,
+                                    "description": new_description,
+                                    "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
+                                })
+                                append_business_rules_meta(new_key, system.business_rules_meta[new_key])
+
+                            if system.save_business_rules():
+                                st.success("✅ 规则已更新")
+                                st.rerun()
+                            else:
+                                st.error("❌ 保存失败")
+
+                    with col_btn2:
+                        if st.button("删除规则", key=f"other_delete_{term}"):
+                            if st.session_state.get(f"other_confirm_delete_{term}", False):
+                                del system.business_rules[term]
+                                if term in system.business_rules_meta:
+                                    del system.business_rules_meta[term]
+                                    append_business_rules_meta(term, None)
+                                if system.save_business_rules():
+                                    st.success("✅ 规则已删除")
+                                    st.rerun()
+                                else:
+                                    st.error("❌ 删除失败")
+                            else:
+                                st.session_state[f"other_confirm_delete_{term}"] = True
+                                st.warning("⚠️ 再次点击确认删除")
+
+                    with col_btn3:
+                        if st.button("复制规则", key=f"other_copy_{term}"):
+                            # 创建副本
+                            copy_key = f"{term}_copy"
+                            system.business_rules[copy_key] = rule_info.copy() if isinstance(rule_info, dict) else rule_info
+                            if system.save_business_rules():
+                                st.success("✅ 规则已复制")
+                                st.rerun()
+                            else:
+                                st.error("❌ 复制失败")
+                
+                    # 显示规则预览
+                    col_preview1, col_preview2, col_preview3 = st.columns([3, 2, 1])
+                
+                    with col_preview1:
+                        if isinstance(rule_info, dict):
+                            preview_text = f"{rule_info.get('business_term', '')} → {rule_info.get('db_field', '')}"
+                            if rule_info.get('condition_value'):
+                                preview_text += f" ({rule_info.get('condition_value', '')})"
+                        else:
+                            preview_text = f"{term} → {rule_info}"
+                        st.text(preview_text)
+                
+                    with col_preview2:
+                        if isinstance(rule_info, dict):
+                            table_info = rule_info.get('table', '全部表')
+                            type_info = rule_info.get('type', '实体')
+                            st.caption(f"表: {table_info} | 类型: {type_info}")
+                        else:
+                            st.caption("旧格式规则")
+                
+                    with col_preview3:
+                        st.caption(f"ID: {term[:10]}...")
+    
+
 def show_business_rules_page_v23(system):
     """业务规则管理页面 V2.3 - 完整功能版"""
     st.header("业务规则管理 V2.3")
@@ -2292,25 +3036,8 @@ def show_business_rules_page_v23(system):
             # 预设规则模板
             st.write("**预设规则模板:**")
             
-            preset_templates = {
-                "教育系统": {
-                    "学生": "student", "课程": "course", "成绩": "score", "教师": "teacher",
-                    "班级": "class", "姓名": "name", "年龄": "age", "性别": "gender",
-                    "优秀": "score >= 90", "良好": "score >= 80 AND score < 90",
-                    "及格": "score >= 60 AND score < 80", "不及格": "score < 60"
-                },
-                "电商系统": {
-                    "用户": "user", "商品": "product", "订单": "order", "支付": "payment",
-                    "库存": "inventory", "价格": "price", "数量": "quantity",
-                    "热销": "sales_count > 100", "新品": "create_date >= DATEADD(month, -1, GETDATE())"
-                },
-                "人事系统": {
-                    "员工": "employee", "部门": "department", "职位": "position",
-                    "薪资": "salary", "考勤": "attendance", "绩效": "performance",
-                    "在职": "status = 'active'", "离职": "status = 'inactive'"
-                }
-            }
-            
+            preset_templates = PRESET_RULE_TEMPLATES
+
             selected_template = st.selectbox("选择模板:", ["无"] + list(preset_templates.keys()))
             
             if selected_template != "无":
@@ -2330,452 +3057,7 @@ def show_business_rules_page_v23(system):
                     else:
                         st.error("应用模板失败")
         
-        # 显示现有术语映射
-        st.subheader("现有术语映射")
-        
-        # 搜索和过滤
-        col_search, col_filter, col_sort = st.columns(3)
-        
-        with col_search:
-            search_term = st.text_input("搜索规则:", placeholder="输入业务术语或数据库术语")
-        
-        with col_filter:
-            # 加载元数据
-            try:
-                with open("business_rules_meta.json", 'r', encoding='utf-8') as f:
-                    business_rules_meta = json.load(f)
-                    system.business_rules_meta = business_rules_meta
-            except:
-                system.business_rules_meta = {}
-            
-            all_types = set()
-            all_tables = set()
-            for meta in system.business_rules_meta.values():
-                if meta.get("type"):
-                    all_types.add(meta["type"])
-                if meta.get("table_restriction"):
-                    all_tables.add(meta["table_restriction"])
-            
-            filter_type = st.selectbox("筛选类型:", ["全部"] + list(all_types))
-            filter_table = st.selectbox("筛选表限制:", ["全部"] + list(all_tables))
-        
-        with col_sort:
-            sort_by = st.selectbox("排序方式:", ["按术语", "按类型", "按创建时间"])
-        
-        # 过滤和排序规则
-        filtered_rules = {}
-        for term, mapping in system.business_rules.items():
-            # 搜索过滤
-            if search_term:
-                if (search_term.lower() not in term.lower() and 
-                    search_term.lower() not in mapping.lower()):
-                    continue
-            
-            # 类型过滤
-            if filter_type != "全部":
-                meta = system.business_rules_meta.get(term, {})
-                if meta.get("type") != filter_type:
-                    continue
-            
-            # 表限制过滤
-            if filter_table != "全部":
-                meta = system.business_rules_meta.get(term, {})
-                if meta.get("table_restriction") != filter_table:
-                    continue
-            
-            filtered_rules[term] = mapping
-        
-        # 排序
-        if sort_by == "按类型":
-            filtered_rules = dict(sorted(filtered_rules.items(), 
-                                       key=lambda x: system.business_rules_meta.get(x[0], {}).get("type", "")))
-        elif sort_by == "按创建时间":
-            filtered_rules = dict(sorted(filtered_rules.items(), 
-                                       key=lambda x: system.business_rules_meta.get(x[0], {}).get("create_time", ""), 
-                                       reverse=True))
-        else:  # 按术语
-            filtered_rules = dict(sorted(filtered_rules.items()))
-        
-        st.write(f"**显示 {len(filtered_rules)} / {len(system.business_rules)} 条规则**")
-        
-        # 批量操作
-        if filtered_rules:
-            col_batch1, col_batch2, col_batch3 = st.columns(3)
-            
-            with col_batch1:
-                if st.button("导出选中规则"):
-                    export_data = {
-                        "business_rules": filtered_rules,
-                        "metadata": {k: v for k, v in system.business_rules_meta.items() if k in filtered_rules},
-                        "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "total_count": len(filtered_rules)
-                    }
-                    
-                    st.download_button(
-                        label="下载JSON文件",
-                        data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                        file_name=f"business_rules_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json"
-                    )
-            
-            with col_batch2:
-                if st.button("批量删除选中"):
-                    if st.session_state.get("confirm_batch_delete_rules", False):
-                        for term in filtered_rules:
-                            del system.business_rules[term]
-                            if term in system.business_rules_meta:
-                                del system.business_rules_meta[term]
-                        
-                        system.save_business_rules()
-                        st.success(f"已删除 {len(filtered_rules)} 条规则")
-                        st.session_state["confirm_batch_delete_rules"] = False
-                        st.rerun()
-                    else:
-                        st.session_state["confirm_batch_delete_rules"] = True
-                        st.warning("再次点击确认批量删除")
-            
-            with col_batch3:
-                if st.button("验证所有规则"):
-                    with st.spinner("正在验证规则..."):
-                        validation_results = []
-                        for term, mapping in filtered_rules.items():
-                            # 简单验证规则格式
-                            issues = []
-                            if not term.strip():
-                                issues.append("业务术语为空")
-                            if not mapping.strip():
-                                issues.append("数据库术语为空")
-                            if len(term) > 50:
-                                issues.append("业务术语过长")
-                            
-                            validation_results.append({
-                                "术语": term,
-                                "映射": mapping,
-                                "状态": "✅ 正常" if not issues else "❌ 异常",
-                                "问题": "; ".join(issues) if issues else ""
-                            })
-                        
-                        st.write("**验证结果:**")
-                        validation_df = pd.DataFrame(validation_results)
-                        st.dataframe(validation_df, use_container_width=True)
-        
-        # 分类显示规则
-        term_categories = {
-            "实体映射": ["学生", "课程", "成绩", "教师", "班级", "用户", "商品", "订单"],
-            "字段映射": ["姓名", "性别", "年龄", "分数", "课程名称", "价格", "数量"],
-            "时间映射": ["今年", "去年", "明年", "25年", "24年", "23年"],
-            "条件映射": ["优秀", "良好", "及格", "不及格", "热销", "新品", "在职", "离职"]
-        }
-        
-        for category, keywords in term_categories.items():
-            category_rules = {}
-            for term, mapping in filtered_rules.items():
-                # 根据关键词或元数据分类
-                meta = system.business_rules_meta.get(term, {})
-                meta_type = meta.get("type", "")
-                
-                if (any(keyword in term for keyword in keywords) or 
-                    (category == "实体映射" and meta_type == "实体") or
-                    (category == "字段映射" and meta_type == "字段") or
-                    (category == "时间映射" and meta_type == "时间") or
-                    (category == "条件映射" and meta_type == "条件")):
-                    category_rules[term] = mapping
-            
-            if category_rules:
-                st.write(f"📂 {category} ({len(category_rules)}条)")
-                for term, rule_info in category_rules.items():
-                    # 处理新的业务规则格式（字典）
-                    if isinstance(rule_info, dict):
-                        business_term = rule_info.get('business_term', term)
-                        db_field = rule_info.get('db_field', '')
-                        condition_type = rule_info.get('condition_type', '等于')
-                        condition_value = rule_info.get('condition_value', '')
-                        table_restriction = rule_info.get('table', '')
-                        rule_type = rule_info.get('type', '实体')
-                        description = rule_info.get('description', '')
-                    else:
-                        # 处理旧的业务规则格式（字符串）
-                        business_term = term
-                        db_field = rule_info
-                        condition_type = '等于'
-                        condition_value = ''
-                        table_restriction = ''
-                        rule_type = '实体'
-                        description = ''
-                    
-                    # 创建编辑表单 - 使用容器而不是expander
-                    with st.container():
-                        st.write(f"**编辑规则: {business_term}**")
-                        col_edit1, col_edit2 = st.columns(2)
-                        
-                        with col_edit1:
-                            new_business_term = st.text_input("业务术语:", value=business_term, key=f"edit_term_{category}_{term}")
-                            new_db_field = st.text_input("数据库字段:", value=db_field, key=f"edit_field_{category}_{term}")
-                            new_condition_type = st.selectbox("条件类型:", ["等于", "包含", "正则"], index=["等于", "包含", "正则"].index(condition_type), key=f"edit_condition_type_{category}_{term}")
-                            new_condition_value = st.text_input("条件值:", value=condition_value, key=f"edit_condition_value_{category}_{term}")
-                        
-                        with col_edit2:
-                            available_tables = list(system.table_knowledge.keys()) if system.table_knowledge else []
-                            table_options = ["全部表"] + available_tables
-                            current_table_index = 0 if not table_restriction else (table_options.index(table_restriction) if table_restriction in table_options else 0)
-                            new_table_restriction = st.selectbox("表限制:", table_options, index=current_table_index, key=f"edit_table_{category}_{term}")
-                            new_rule_type = st.selectbox("规则类型:", ["实体", "字段", "条件", "时间"], index=["实体", "字段", "条件", "时间"].index(rule_type), key=f"edit_type_{category}_{term}")
-                            new_description = st.text_input("描述:", value=description, key=f"edit_desc_{category}_{term}")
-                        
-                        col_btn1, col_btn2, col_btn3 = st.columns(3)
-                        
-                        with col_btn1:
-                            if st.button("保存更改", key=f"save_{category}_{term}"):
-                                # 创建新的规则对象
-                                new_rule = {
-                                    "business_term": new_business_term,
-                                    "db_field": new_db_field,
-                                    "condition_type": new_condition_type,
-                                    "condition_value": new_condition_value,
-                                    "table": new_table_restriction if new_table_restriction != "全部表" else None,
-                                    "type": new_rule_type,
-                                    "description": new_description,
-                                    "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
-                                }
-                                
-                                # 如果术语改变了，需要更新键
-                                if new_business_term != business_term:
-                                    del system.business_rules[term]
-                                    new_key = f"{new_table_restriction}_{new_business_term}" if new_table_restriction != "全部表" else new_business_term
-                                else:
-                                    new_key = term
-                                
-                                system.business_rules[new_key] = new_rule
-                                
-                                # 更新元数据
-                                if new_key in system.business_rules_meta:
-                                    system.business_rules_meta[new_key].update({
-                                        "type": new_rule_type,
-                                        "table_restriction": new_table_restriction if new_table_restriction != "全部表" else None,
-                                        "description": new_description,
-                                        "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
-                                    })
-                                
-                                if system.save_business_rules():
-                                    st.success("✅ 规则已更新")
-                                    st.rerun()
-                                else:
-                                    st.error("❌ 保存失败")
-                        
-                        with col_btn2:
-                            if st.button("删除规则", key=f"delete_{category}_{term}"):
-                                if st.session_state.get(f"confirm_delete_{term}", False):
-                                    del system.business_rules[term]
-                                    if term in system.business_rules_meta:
-                                        del system.business_rules_meta[term]
-                                    if system.save_business_rules():
-                                        st.success("✅ 规则已删除")
-                                        st.rerun()
-                                    else:
-                                        st.error("❌ 删除失败")
-                                else:
-                                    st.session_state[f"confirm_delete_{term}"] = True
-                                    st.warning("⚠️ 再次点击确认删除")
-                        
-                        with col_btn3:
-                            if st.button("复制规则", key=f"copy_{category}_{term}"):
-                                # 创建副本
-                                copy_key = f"{term}_copy"
-                                system.business_rules[copy_key] = rule_info.copy() if isinstance(rule_info, dict) else rule_info
-                                if system.save_business_rules():
-                                    st.success("✅ 规则已复制")
-                                    st.rerun()
-                                else:
-                                    st.error("❌ 复制失败")
-                        
-                        # 显示规则预览
-                        col_preview1, col_preview2, col_preview3 = st.columns([3, 2, 1])
-                        
-                        with col_preview1:
-                            if isinstance(rule_info, dict):
-                                preview_text = f"{rule_info.get('business_term', '')} → {rule_info.get('db_field', '')}"
-                                if rule_info.get('condition_value'):
-                                    preview_text += f" ({rule_info.get('condition_value', '')})"
-                            else:
-                                preview_text = f"{term} → {rule_info}"
-                            st.text(preview_text)
-                        
-                        with col_preview2:
-                            if isinstance(rule_info, dict):
-                                table_info = rule_info.get('table', '全部表')
-                                type_info = rule_info.get('type', '实体')
-                                st.caption(f"表: {table_info} | 类型: {type_info}")
-                            else:
-                                st.caption("旧格式规则")
-                        
-                        with col_preview3:
-                            st.caption(f"ID: {term[:10]}...")
-                        
-                        # 显示元数据
-                        meta = system.business_rules_meta.get(term, {})
-                        if meta:
-                            meta_info = []
-                            if meta.get("type"):
-                                meta_info.append(f"类型: {meta['type']}")
-                            if meta.get("table_restriction"):
-                                meta_info.append(f"表限制: {meta['table_restriction']}")
-                            elif meta.get("table_restriction") is None:
-                                meta_info.append("表限制: 全部表")
-                            if meta.get("description"):
-                                meta_info.append(f"描述: {meta['description']}")
-                            if meta.get("create_time"):
-                                meta_info.append(f"创建: {meta['create_time']}")
-                            if meta.get("usage_count", 0) > 0:
-                                meta_info.append(f"使用: {meta['usage_count']}次")
-                            
-                            if meta_info:
-                                st.caption(" | ".join(meta_info))
-        
-        # 其他未分类规则
-        other_rules = {}
-        for term, mapping in filtered_rules.items():
-            is_categorized = False
-            for keywords in term_categories.values():
-                if any(keyword in term for keyword in keywords):
-                    is_categorized = True
-                    break
-            
-            meta = system.business_rules_meta.get(term, {})
-            if meta.get("type") in ["实体", "字段", "时间", "条件"]:
-                is_categorized = True
-            
-            if not is_categorized:
-                other_rules[term] = mapping
-        
-        if other_rules:
-            with st.expander(f"📂 其他规则 ({len(other_rules)}条)"):
-                for term, rule_info in other_rules.items():
-                    # 处理新的业务规则格式（字典）
-                    if isinstance(rule_info, dict):
-                        business_term = rule_info.get('business_term', term)
-                        db_field = rule_info.get('db_field', '')
-                        condition_type = rule_info.get('condition_type', '等于')
-                        condition_value = rule_info.get('condition_value', '')
-                        table_restriction = rule_info.get('table', '')
-                        rule_type = rule_info.get('type', '实体')
-                        description = rule_info.get('description', '')
-                    else:
-                        # 处理旧的业务规则格式（字符串）
-                        business_term = term
-                        db_field = rule_info
-                        condition_type = '等于'
-                        condition_value = ''
-                        table_restriction = ''
-                        rule_type = '实体'
-                        description = ''
-                    
-                    # 创建编辑表单
-                    with st.container():
-                        st.write(f"**编辑规则: {business_term}**")
-                        col_edit1, col_edit2 = st.columns(2)
-
-                        with col_edit1:
-                            new_business_term = st.text_input("业务术语:", value=business_term, key=f"other_edit_term_{term}")
-                            new_db_field = st.text_input("数据库字段:", value=db_field, key=f"other_edit_field_{term}")
-                            new_condition_type = st.selectbox("条件类型:", ["等于", "包含", "正则"], index=["等于", "包含", "正则"].index(condition_type), key=f"other_edit_condition_type_{term}")
-                            new_condition_value = st.text_input("条件值:", value=condition_value, key=f"other_edit_condition_value_{term}")
-                        with col_edit2:
-                            available_tables = list(system.table_knowledge.keys()) if system.table_knowledge else []
-                            table_options = ["全部表"] + available_tables
-                            current_table_index = 0 if not table_restriction else (table_options.index(table_restriction) if table_restriction in table_options else 0)
-                            new_table_restriction = st.selectbox("表限制:", table_options, index=current_table_index, key=f"other_edit_table_{term}")
-                            new_rule_type = st.selectbox("规则类型:", ["实体", "字段", "条件", "时间"], index=["实体", "字段", "条件", "时间"].index(rule_type), key=f"other_edit_type_{term}")
-                            new_description = st.text_input("描述:", value=description, key=f"other_edit_desc_{term}")
-
-                        col_btn1, col_btn2, col_btn3 = st.columns(3)
-
-                        with col_btn1:
-                            if st.button("保存更改", key=f"other_save_{term}"):
-                                # 创建新的规则对象
-                                new_rule = {
-                                    "business_term": new_business_term,
-                                    "db_field": new_db_field,
-                                    "condition_type": new_condition_type,
-                                    "condition_value": new_condition_value,
-                                    "table": new_table_restriction if new_table_restriction != "全部表" else None,
-                                    "type": new_rule_type,
-                                    "description": new_description,
-                                    "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
-                                }
-
-                                # 如果术语改变了，需要更新键
-                                if new_business_term != business_term:
-                                    del system.business_rules[term]
-                                    new_key = f"{new_table_restriction}_{new_business_term}" if new_table_restriction != "全部表" else new_business_term
-                                else:
-                                    new_key = term
-
-                                system.business_rules[new_key] = new_rule
-
-                                # 更新元数据
-                                if new_key in system.business_rules_meta:
-                                    system.business_rules_meta[new_key].update({
-                                        "type": new_rule_type,
-                                        "table_restriction": new_table_restriction if new_table_restriction != "全部表" else None,
-                                        "description": new_description,
-                                        "update_time": time.strftime("%Y-%m-%d %H:%M:%S")
-                                    })
-
-                                if system.save_business_rules():
-                                    st.success("✅ 规则已更新")
-                                    st.rerun()
-                                else:
-                                    st.error("❌ 保存失败")
-
-                        with col_btn2:
-                            if st.button("删除规则", key=f"other_delete_{term}"):
-                                if st.session_state.get(f"other_confirm_delete_{term}", False):
-                                    del system.business_rules[term]
-                                    if term in system.business_rules_meta:
-                                        del system.business_rules_meta[term]
-                                    if system.save_business_rules():
-                                        st.success("✅ 规则已删除")
-                                        st.rerun()
-                                    else:
-                                        st.error("❌ 删除失败")
-                                else:
-                                    st.session_state[f"other_confirm_delete_{term}"] = True
-                                    st.warning("⚠️ 再次点击确认删除")
-
-                        with col_btn3:
-                            if st.button("复制规则", key=f"other_copy_{term}"):
-                                # 创建副本
-                                copy_key = f"{term}_copy"
-                                system.business_rules[copy_key] = rule_info.copy() if isinstance(rule_info, dict) else rule_info
-                                if system.save_business_rules():
-                                    st.success("✅ 规则已复制")
-                                    st.rerun()
-                                else:
-                                    st.error("❌ 复制失败")
-                        
-                        # 显示规则预览
-                        col_preview1, col_preview2, col_preview3 = st.columns([3, 2, 1])
-                        
-                        with col_preview1:
-                            if isinstance(rule_info, dict):
-                                preview_text = f"{rule_info.get('business_term', '')} → {rule_info.get('db_field', '')}"
-                                if rule_info.get('condition_value'):
-                                    preview_text += f" ({rule_info.get('condition_value', '')})"
-                            else:
-                                preview_text = f"{term} → {rule_info}"
-                            st.text(preview_text)
-                        
-                        with col_preview2:
-                            if isinstance(rule_info, dict):
-                                table_info = rule_info.get('table', '全部表')
-                                type_info = rule_info.get('type', '实体')
-                                st.caption(f"表: {table_info} | 类型: {type_info}")
-                            else:
-                                st.caption("旧格式规则")
-                        
-                        with col_preview3:
-                            st.caption(f"ID: {term[:10]}...")
-    
+        show_rules_browser(system)
     with col2:
         st.subheader("V2.3业务规则管理增强")
         st.markdown("""
@@ -2808,52 +3090,47 @@ def show_business_rules_page_v23(system):
         st.subheader("统计信息")
         
         total_rules = len(system.business_rules)
-        filtered_count = len(filtered_rules) if 'filtered_rules' in locals() else total_rules
+        filtered_count = st.session_state.get("br_filtered_count", total_rules)
         
         st.metric("总规则数", total_rules)
         st.metric("显示规则数", filtered_count)
         
-        # 规则分类统计
+        # 类型分布 + 使用频率TOP5：单趟扫描元数据，TOP5用有界小顶堆
         type_count = {}
-        for meta in system.business_rules_meta.values():
-            rule_type = meta.get("type", "未分类")
-            type_count[rule_type] = type_count.get(rule_type, 0) + 1
-        
+        usage_heap = []
+        if total_rules:
+            for term, meta in system.business_rules_meta.items():
+                rule_type = meta.get("type", "未分类")
+                type_count[rule_type] = type_count.get(rule_type, 0) + 1
+                usage_count = meta.get("usage_count", 0)
+                if usage_count > 0:
+                    heapq.heappush(usage_heap, (usage_count, term))
+                    if len(usage_heap) > 5:
+                        heapq.heappop(usage_heap)
+
         if type_count:
             st.write("**类型分布:**")
             for rule_type, count in type_count.items():
                 st.write(f"- {rule_type}: {count}")
-        
-        # 使用频率统计
-        usage_stats = []
-        for term, meta in system.business_rules_meta.items():
-            usage_count = meta.get("usage_count", 0)
-            if usage_count > 0:
-                usage_stats.append((term, usage_count))
-        
-        if usage_stats:
-            usage_stats.sort(key=lambda x: x[1], reverse=True)
+
+        if usage_heap:
             st.write("**使用频率TOP5:**")
-            for term, count in usage_stats[:5]:
-                st.write(f"- {term}: {count}次")
+            for usage_count, term in sorted(usage_heap, reverse=True):
+                st.write(f"- {term}: {usage_count}次")
         
         # 数据管理
         st.subheader("数据管理")
         
-        if st.button("导出所有规则"):
-            export_data = {
+        deferred_json_download(
+            "导出所有规则", "export_all_rules",
+            lambda: {
                 "business_rules": system.business_rules,
                 "metadata": system.business_rules_meta,
                 "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
                 "version": "V2.3"
-            }
-            
-            st.download_button(
-                label="下载JSON文件",
-                data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                file_name=f"business_rules_complete_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                mime="application/json"
-            )
+            },
+            lambda: f"business_rules_complete_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
         
         # 重置功能
         if st.button("重置为默认规则"):
@@ -2988,6 +3265,67 @@ def show_business_rules_page_v23(system):
         else:
             st.warning("请先导入表结构到知识库")
 
+@_fragment
+def show_template_preview(system, selected_template, test_data):
+    """模板预览/SQL测试块（fragment局部渲染：点"生成预览"或"测试SQL生成"
+    只重跑本块，不再重建整页的模板列表和元数据加载）"""
+    # 预览结果存session_state：点"测试SQL生成"触发的rerun里外层按钮已是False，
+    # 不重跑format也不丢预览（嵌套button第二次点击原本根本进不来）
+    preview_key = "_preview_" + selected_template
+    if st.button("生成预览"):
+        template_content = system.prompt_templates[selected_template]
+        # 先做集合差集校验，缺变量直接报出来，不走KeyError异常路径
+        missing = _required_vars(template_content) - test_data.keys()
+        if missing:
+            st.session_state.pop(preview_key, None)
+            st.error(f"模板变量缺失: {', '.join(sorted(missing))}")
+        else:
+            try:
+                # format_map免一次dict解包拷贝
+                st.session_state[preview_key] = template_content.format_map(test_data)
+            except Exception as e:
+                st.session_state.pop(preview_key, None)
+                st.error(f"预览生成失败: {e}")
+
+    preview_result = st.session_state.get(preview_key)
+    if preview_result is None:
+        return
+
+    st.write("**预览结果:**")
+    st.text_area("", value=preview_result, height=300, key="preview_result")
+
+    # 统计信息
+    preview_length = len(preview_result)
+    preview_lines = len(preview_result.split('\n'))
+
+    col_stat1, col_stat2, col_stat3 = st.columns(3)
+    with col_stat1:
+        st.metric("预览长度", f"{preview_length} 字符")
+    with col_stat2:
+        st.metric("预览行数", preview_lines)
+    with col_stat3:
+        # 估算token数量（粗略估算）
+        estimated_tokens = preview_length // 4
+        st.metric("估算Tokens", estimated_tokens)
+
+    # 如果是SQL生成模板，可以测试生成（优先读元数据标记，老模板回退名称判断）
+    tpl_meta = system.template_metadata.get(selected_template, {})
+    if tpl_meta.get("is_sql", "sql" in selected_template.lower()) and "question" in test_data:
+        if st.button("测试SQL生成"):
+            with st.spinner("正在测试SQL生成..."):
+                try:
+                    # 模拟调用API（相同提示词走缓存）
+                    test_sql = _cached_deepseek(system, preview_result)
+                    cleaned_sql = system.clean_sql(test_sql)
+
+                    if cleaned_sql:
+                        st.success("SQL生成测试成功")
+                        st.code(cleaned_sql, language="sql")
+                    else:
+                        st.warning("SQL生成为空")
+                except Exception as e:
+                    st.error(f"SQL生成测试失败: {e}")
+
 def show_prompt_templates_page_v23(system):
     """提示词管理页面 V2.3 - 完整功能版"""
     st.header("提示词管理 V2.3")
@@ -3008,7 +3346,7 @@ def show_prompt_templates_page_v23(system):
             # 模板信息
             current_template = system.prompt_templates[selected_template]
             template_length = len(current_template)
-            variable_count = len(re.findall(r'\{(\w+)\}', current_template))
+            variable_count = len(_VAR_RE.findall(current_template))
             
             col_info1, col_info2, col_info3 = st.columns(3)
             with col_info1:
@@ -3032,8 +3370,8 @@ def show_prompt_templates_page_v23(system):
                 st.info("⚠️ 模板已修改，记得保存")
                 
                 # 分析新模板中的变量
-                new_variables = set(re.findall(r'\{(\w+)\}', new_template))
-                old_variables = set(re.findall(r'\{(\w+)\}', current_template))
+                new_variables = set(_VAR_RE.findall(new_template))
+                old_variables = set(_VAR_RE.findall(current_template))
                 
                 added_vars = new_variables - old_variables
                 removed_vars = old_variables - new_variables
@@ -3110,14 +3448,14 @@ def show_prompt_templates_page_v23(system):
                             "priority": template_priority,
                             "description": template_description,
                             "create_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "usage_count": 0
+                            "usage_count": 0,
+                            "is_sql": "sql" in new_template_name.lower()
                         }
                         
                         if system.save_prompt_templates():
                             # 保存元数据
                             try:
-                                with open("template_metadata.json", 'w', encoding='utf-8') as f:
-                                    json.dump(system.template_metadata, f, ensure_ascii=False, indent=2)
+                                atomic_write_json("template_metadata.json", system.template_metadata)
                             except:
                                 pass
                             
@@ -3133,7 +3471,7 @@ def show_prompt_templates_page_v23(system):
             st.subheader("模板预览和测试")
             
             # 分析模板中的变量
-            variables = re.findall(r'\{(\w+)\}', system.prompt_templates[selected_template])
+            variables = _VAR_RE.findall(system.prompt_templates[selected_template])
             unique_variables = list(set(variables))
             
             if unique_variables:
@@ -3149,14 +3487,14 @@ def show_prompt_templates_page_v23(system):
                         if var == "schema_info":
                             test_data[var] = "表名: users\n字段: id, name, email, age"
                         elif var == "table_knowledge":
-                            test_data[var] = json.dumps(dict(list(system.table_knowledge.items())[:2]), 
-                                                       ensure_ascii=False, indent=2) if system.table_knowledge else "{}"
+                            test_data[var] = knowledge_preview_json(
+                                "tpl_preview_tk", kb_version(), system.table_knowledge, 2)
                         elif var == "product_knowledge":
-                            test_data[var] = json.dumps(dict(list(system.product_knowledge.items())[:2]), 
-                                                       ensure_ascii=False, indent=2) if system.product_knowledge else "{}"
+                            test_data[var] = knowledge_preview_json(
+                                "tpl_preview_pk", pk_version(), system.product_knowledge, 2)
                         elif var == "business_rules":
-                            test_data[var] = json.dumps(dict(list(system.business_rules.items())[:5]), 
-                                                       ensure_ascii=False, indent=2) if system.business_rules else "{}"
+                            test_data[var] = knowledge_preview_json(
+                                "tpl_preview_br", kb_version(), system.business_rules, 5)
                         
                         st.text_area(f"{var} ({var_description}):", value=test_data[var], height=100, key=f"test_{var}")
                     else:
@@ -3164,49 +3502,8 @@ def show_prompt_templates_page_v23(system):
                         default_value = get_default_test_value(var)
                         test_data[var] = st.text_input(f"{var} ({var_description}):", value=default_value, key=f"test_{var}")
                 
-                # 生成预览
-                if st.button("生成预览"):
-                    try:
-                        preview_result = system.prompt_templates[selected_template].format(**test_data)
-                        
-                        st.write("**预览结果:**")
-                        st.text_area("", value=preview_result, height=300, key="preview_result")
-                        
-                        # 统计信息
-                        preview_length = len(preview_result)
-                        preview_lines = len(preview_result.split('\n'))
-                        
-                        col_stat1, col_stat2, col_stat3 = st.columns(3)
-                        with col_stat1:
-                            st.metric("预览长度", f"{preview_length} 字符")
-                        with col_stat2:
-                            st.metric("预览行数", preview_lines)
-                        with col_stat3:
-                            # 估算token数量（粗略估算）
-                            estimated_tokens = preview_length // 4
-                            st.metric("估算Tokens", estimated_tokens)
-                        
-                        # 如果是SQL生成模板，可以测试生成
-                        if "sql" in selected_template.lower() and "question" in test_data:
-                            if st.button("测试SQL生成"):
-                                with st.spinner("正在测试SQL生成..."):
-                                    try:
-                                        # 模拟调用API
-                                        test_sql = system.call_deepseek_api(preview_result)
-                                        cleaned_sql = system.clean_sql(test_sql)
-                                        
-                                        if cleaned_sql:
-                                            st.success("SQL生成测试成功")
-                                            st.code(cleaned_sql, language="sql")
-                                        else:
-                                            st.warning("SQL生成为空")
-                                    except Exception as e:
-                                        st.error(f"SQL生成测试失败: {e}")
-                        
-                    except KeyError as e:
-                        st.error(f"模板变量错误: {e}")
-                    except Exception as e:
-                        st.error(f"预览生成失败: {e}")
+                # 生成预览（fragment局部rerun，点按钮不重跑整页）
+                show_template_preview(system, selected_template, test_data)
             else:
                 st.info("此模板不包含变量，直接显示内容")
                 st.text_area("模板内容:", value=system.prompt_templates[selected_template], height=200)
@@ -3218,11 +3515,15 @@ def show_prompt_templates_page_v23(system):
         # 模板管理
         st.subheader("模板管理")
         
-        # 加载模板元数据
-        try:
-            with open("template_metadata.json", 'r', encoding='utf-8') as f:
-                system.template_metadata = json.load(f)
-        except:
+        # 加载模板元数据（mtime入缓存键：文件被重写后自动失效）
+        # 没有模板时下面的列表不会读元数据，连stat都省掉
+        if system.prompt_templates:
+            try:
+                system.template_metadata = _load_template_metadata(
+                    os.path.getmtime("template_metadata.json"))
+            except:
+                system.template_metadata = {}
+        else:
             system.template_metadata = {}
         
         # 模板列表
@@ -3230,36 +3531,50 @@ def show_prompt_templates_page_v23(system):
         
         with col_list1:
             st.write("**模板列表:**")
-            
-            for template_name in system.prompt_templates.keys():
+
+            # 分页：每次rerun只建当前页20个expander，widget数量与模板总量无关
+            template_names = list(system.prompt_templates.keys())
+            tpl_page_size = 20
+            tpl_total_pages = max(1, -(-len(template_names) // tpl_page_size))
+            if tpl_total_pages > 1:
+                tpl_page = st.number_input("页码:", min_value=1, max_value=tpl_total_pages,
+                                           value=1, key="template_list_page")
+            else:
+                tpl_page = 1
+
+            for template_name in template_names[(tpl_page - 1) * tpl_page_size: tpl_page * tpl_page_size]:
                 with st.expander(f"📝 {template_name}"):
                     template_content = system.prompt_templates[template_name]
                     metadata = system.template_metadata.get(template_name, {})
-                    
+                    # 一次取齐元数据字段，行内不再反复metadata.get
+                    category = metadata.get('category', '未知')
+                    language = metadata.get('language', '未知')
+                    priority = metadata.get('priority', '未知')
+                    usage_count = metadata.get('usage_count', 0)
+                    description = metadata.get('description', '')
+                    create_time = metadata.get('create_time', '')
+
                     # 基本信息
                     col_meta1, col_meta2, col_meta3 = st.columns(3)
-                    
+
                     with col_meta1:
-                        st.write(f"**分类**: {metadata.get('category', '未知')}")
-                        st.write(f"**语言**: {metadata.get('language', '未知')}")
-                    
+                        st.write(f"**分类**: {category}")
+                        st.write(f"**语言**: {language}")
+
                     with col_meta2:
-                        st.write(f"**优先级**: {metadata.get('priority', '未知')}")
+                        st.write(f"**优先级**: {priority}")
                         st.write(f"**长度**: {len(template_content)} 字符")
-                    
+
                     with col_meta3:
-                        variables = len(set(re.findall(r'\{(\w+)\}', template_content)))
+                        variables = _count_vars(template_content)
                         st.write(f"**变量数**: {variables}")
-                        usage_count = metadata.get('usage_count', 0)
                         st.write(f"**使用次数**: {usage_count}")
-                    
+
                     # 描述
-                    description = metadata.get('description', '')
                     if description:
                         st.write(f"**描述**: {description}")
-                    
+
                     # 时间信息
-                    create_time = metadata.get('create_time', '')
                     if create_time:
                         st.write(f"**创建时间**: {create_time}")
                     
@@ -3274,17 +3589,27 @@ def show_prompt_templates_page_v23(system):
                     
                     with col_op2:
                         if st.button("复制", key=f"copy_template_{template_name}"):
-                            copy_name = f"{template_name}_副本"
-                            counter = 1
-                            while copy_name in system.prompt_templates:
-                                copy_name = f"{template_name}_副本{counter}"
-                                counter += 1
+                            # 单趟扫描已有副本后缀，直接算出下一个空位
+                            copy_re = re.compile(rf'^{re.escape(template_name)}_副本(\d*)$')
+                            suffixes = [int(m.group(1)) for k in system.prompt_templates
+                                        if (m := copy_re.match(k)) and m.group(1)]
+                            if suffixes:
+                                copy_name = f"{template_name}_副本{max(suffixes) + 1}"
+                            elif f"{template_name}_副本" in system.prompt_templates:
+                                copy_name = f"{template_name}_副本1"
+                            else:
+                                copy_name = f"{template_name}_副本"
                             
                             system.prompt_templates[copy_name] = template_content
                             system.template_metadata[copy_name] = metadata.copy()
                             system.template_metadata[copy_name]["create_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                            
-                            system.save_prompt_templates()
+
+                            # 元数据必须在rerun前落盘：下个rerun会按mtime重载这份文件
+                            try:
+                                atomic_write_json("template_metadata.json", system.template_metadata)
+                            except:
+                                pass
+                            st.session_state["_tpl_dirty"] = True
                             st.success(f"已复制为: {copy_name}")
                             st.rerun()
                     
@@ -3295,8 +3620,13 @@ def show_prompt_templates_page_v23(system):
                                     del system.prompt_templates[template_name]
                                     if template_name in system.template_metadata:
                                         del system.template_metadata[template_name]
-                                    
-                                    system.save_prompt_templates()
+                                        # 同复制：rerun会从文件重载元数据，先写掉
+                                        try:
+                                            atomic_write_json("template_metadata.json", system.template_metadata)
+                                        except:
+                                            pass
+
+                                    st.session_state["_tpl_dirty"] = True
                                     st.success(f"已删除模板: {template_name}")
                                     st.rerun()
                                 else:
@@ -3309,20 +3639,16 @@ def show_prompt_templates_page_v23(system):
             # 批量操作
             st.write("**批量操作:**")
             
-            if st.button("导出所有模板"):
-                export_data = {
+            deferred_json_download(
+                "导出所有模板", "export_all_templates",
+                lambda: {
                     "prompt_templates": system.prompt_templates,
                     "metadata": system.template_metadata,
                     "export_time": time.strftime("%Y-%m-%d %H:%M:%S"),
                     "version": "V2.3"
-                }
-                
-                st.download_button(
-                    label="下载JSON文件",
-                    data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                    file_name=f"prompt_templates_{time.strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
+                },
+                lambda: f"prompt_templates_{time.strftime('%Y%m%d_%H%M%S')}.json",
+            )
             
             # 导入模板
             uploaded_file = st.file_uploader("导入模板文件", type=['json'])
@@ -3355,6 +3681,8 @@ def show_prompt_templates_page_v23(system):
                             system.prompt_templates[name] = content
                             if name in metadata_to_import:
                                 system.template_metadata[name] = metadata_to_import[name]
+                                system.template_metadata[name].setdefault(
+                                    "is_sql", "sql" in name.lower())
                             imported_count += 1
                         
                         if system.save_prompt_templates():
@@ -3428,65 +3756,82 @@ def show_prompt_templates_page_v23(system):
         total_templates = len(system.prompt_templates)
         st.metric("模板总数", total_templates)
         
-        # 分类统计
-        category_count = {}
-        for metadata in system.template_metadata.values():
-            category = metadata.get("category", "未分类")
-            category_count[category] = category_count.get(category, 0) + 1
-        
+        # 分类统计（Counter走C路径）
+        category_count = Counter(metadata.get("category", "未分类")
+                                 for metadata in system.template_metadata.values())
+
         if category_count:
             st.write("**分类分布:**")
             for category, count in category_count.items():
                 st.write(f"- {category}: {count}")
-        
-        # 使用统计
-        usage_stats = []
-        for name, metadata in system.template_metadata.items():
-            usage_count = metadata.get("usage_count", 0)
-            if usage_count > 0:
-                usage_stats.append((name, usage_count))
-        
+
+        # 使用统计：只要TOP3，nlargest免整表排序
+        usage_stats = heapq.nlargest(
+            3,
+            ((name, metadata.get("usage_count", 0))
+             for name, metadata in system.template_metadata.items()
+             if metadata.get("usage_count", 0) > 0),
+            key=lambda x: x[1],
+        )
+
         if usage_stats:
-            usage_stats.sort(key=lambda x: x[1], reverse=True)
             st.write("**使用频率TOP3:**")
-            for name, count in usage_stats[:3]:
+            for name, count in usage_stats:
                 st.write(f"- {name}: {count}次")
         
-        # 模板长度统计
-        lengths = [len(template) for template in system.prompt_templates.values()]
-        if lengths:
-            avg_length = sum(lengths) // len(lengths)
-            max_length = max(lengths)
-            min_length = min(lengths)
+        # 模板长度统计（fromiter免中间list，三个归约都走C层）
+        lengths = np.fromiter((len(t) for t in system.prompt_templates.values()),
+                              dtype=np.int64, count=len(system.prompt_templates))
+        if lengths.size:
+            avg_length = int(lengths.mean())
+            max_length = int(lengths.max())
+            min_length = int(lengths.min())
             
             st.write("**长度统计:**")
             st.write(f"- 平均长度: {avg_length} 字符")
             st.write(f"- 最长模板: {max_length} 字符")
             st.write(f"- 最短模板: {min_length} 字符")
 
+    # 复制/删除只置脏标记，这里统一落盘：2秒内的连续操作合并成一次整文件重写。
+    # 元数据不在这里写——handler里rerun前已同步落盘，这边只管模板文件
+    if st.session_state.get("_tpl_dirty") and \
+            time.time() - st.session_state.get("_tpl_last_save", 0) > 2:
+        system.save_prompt_templates()
+        st.session_state["_tpl_last_save"] = time.time()
+        st.session_state["_tpl_dirty"] = False
+
+# 变量说明/默认测试值（模块级常量：渲染循环里每个变量调一次，不再重建dict字面量）
+_VAR_DESCRIPTIONS = {
+    "schema_info": "数据库结构信息，包含表名和字段信息",
+    "table_knowledge": "表结构知识库，包含表和字段的备注说明",
+    "product_knowledge": "产品知识库，包含产品信息和业务规则",
+    "business_rules": "业务规则，包含术语映射和条件转换",
+    "question": "用户输入的自然语言问题",
+    "processed_question": "经过业务规则处理后的问题",
+    "sql": "生成的SQL语句，用于验证模板",
+    "allowed_tables": "允许使用的表列表"
+}
+
+_VAR_DEFAULTS = {
+    "question": "查询所有学生信息",
+    "processed_question": "查询所有student信息",
+    "sql": "SELECT * FROM students;",
+    "allowed_tables": "students, courses, scores"
+}
+
 def get_variable_description_v23(var_name):
     """获取变量描述 V2.3版本"""
-    descriptions = {
-        "schema_info": "数据库结构信息，包含表名和字段信息",
-        "table_knowledge": "表结构知识库，包含表和字段的备注说明",
-        "product_knowledge": "产品知识库，包含产品信息和业务规则",
-        "business_rules": "业务规则，包含术语映射和条件转换",
-        "question": "用户输入的自然语言问题",
-        "processed_question": "经过业务规则处理后的问题",
-        "sql": "生成的SQL语句，用于验证模板",
-        "allowed_tables": "允许使用的表列表"
-    }
-    return descriptions.get(var_name, "未知变量")
+    return _VAR_DESCRIPTIONS.get(var_name, "未知变量")
 
 def get_default_test_value(var_name):
     """获取变量的默认测试值"""
-    defaults = {
-        "question": "查询所有学生信息",
-        "processed_question": "查询所有student信息",
-        "sql": "SELECT * FROM students;",
-        "allowed_tables": "students, courses, scores"
-    }
-    return defaults.get(var_name, "")
+    return _VAR_DEFAULTS.get(var_name, "")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_test_conn(_system, db_type, cfg_key):
+    """连接测试结果缓存30秒：监控页rerun不再每次都付一轮TCP/ODBC往返。
+    cfg_key是config排序后的items元组（可哈希，进缓存键）"""
+    return _system.db_manager.test_connection(db_type, dict(cfg_key))
 
 def show_system_monitoring_page_v23(system):
     """系统监控页面 V2.3 - 新增功能"""
@@ -3507,9 +3852,10 @@ def show_system_monitoring_page_v23(system):
         st.subheader("数据库连接")
         for db_id, db_config in system.databases.items():
             if db_config.get("active", False):
-                success, msg = system.db_manager.test_connection(
-                    db_config["type"], 
-                    db_config["config"]
+                success, msg = _cached_test_conn(
+                    system,
+                    db_config["type"],
+                    tuple(sorted(db_config["config"].items()))
                 )
                 status = "🟢 正常" if success else "🔴 异常"
                 st.write(f"{db_config['name']}: {status}")
@@ -3528,11 +3874,14 @@ def show_system_monitoring_page_v23(system):
             st.success("ChromaDB已重新初始化")
         
         if st.button("测试所有数据库连接"):
+            # 手动测试要真实结果：先清缓存再逐个连
+            _cached_test_conn.clear()
             for db_id, db_config in system.databases.items():
                 if db_config.get("active", False):
-                    success, msg = system.db_manager.test_connection(
-                        db_config["type"], 
-                        db_config["config"]
+                    success, msg = _cached_test_conn(
+                        system,
+                        db_config["type"],
+                        tuple(sorted(db_config["config"].items()))
                     )
                     if success:
                         st.success(f"{db_config['name']}: {msg}")
@@ -3634,8 +3983,7 @@ def show_product_hierarchy_page_v25(system):
                     product_hierarchy["product_hierarchy"]["dimension_mapping"][dim_name] = new_dim
                     
                     # 保存配置
-                    with open("product_hierarchy.json", 'w', encoding='utf-8') as f:
-                        json.dump(product_hierarchy, f, ensure_ascii=False, indent=2)
+                    atomic_write_json("product_hierarchy.json", product_hierarchy)
                     
                     st.success(f"已添加维度映射: {dim_name}")
                     st.rerun()
@@ -3771,8 +4119,7 @@ WHERE [Product Line] = 'IdeaCentre'
                     }
                 }
                 
-                with open("product_hierarchy.json", 'w', encoding='utf-8') as f:
-                    json.dump(default_hierarchy, f, ensure_ascii=False, indent=2)
+                atomic_write_json("product_hierarchy.json", default_hierarchy)
                 
                 st.success("已重置为默认配置")
                 st.session_state["confirm_reset_hierarchy"] = False
@@ -3858,12 +4205,12 @@ def main():
     table_knowledge = load_json("table_knowledge.json")
     relationships = load_json("table_relationships.json")
     business_rules = load_json("business_rules.json")
-    product_knowledge = load_json("product_knowledge.json")
-    historical_qa = load_json("historical_qa.json")
-    prompt_templates = load_json("prompt_templates.json")
+    product_knowledge = load_product_knowledge_singleton()
+    historical_qa = load_historical_qa()
+    prompt_templates = load_prompt_templates_cached()
     
     # 初始化组件
-    db_manager = DatabaseManager()
+    db_manager = _get_db_manager()
     vanna = VannaWrapper()
     
     # 初始化系统